@@ -5,10 +5,331 @@ AI接口核心模块：负责调用大模型API和处理响应
 import os
 import json
 import time
-import httpx
 import asyncio
+import random
+import hashlib
+import importlib.util
+from collections import Counter, OrderedDict, deque
 from typing import Dict, List, Any, Optional, Callable, AsyncGenerator, Union
-from config import get_api_config
+from config import API_CONFIG, STREAM_CONFIG, get_api_config
+
+# create_messages不依赖httpx，放在独立模块中，这里重新导出以保持兼容
+from ai_prompts import create_messages
+from json_utils import json_dumps, json_loads
+
+# SSE帧前缀和结束帧
+_SSE_DATA_PREFIX = b"data: "
+_SSE_DATA_PREFIX_LEN = len(_SSE_DATA_PREFIX)
+_SSE_DONE = b"data: [DONE]"
+
+# 响应压缩格式的优先级，解压越快越靠前
+_ENCODING_PREFERENCE = ("zstd", "br", "gzip", "deflate")
+
+# 重试无意义的HTTP状态码（请求本身或身份验证有误）
+_NON_RETRIABLE_STATUS = frozenset({400, 401, 403})
+
+# 错误信息中保留的响应体最大字节数
+_ERROR_BODY_LIMIT = 512
+
+
+class APIError(Exception):
+    """API调用失败时抛出的异常"""
+    
+    def __init__(self, message: str, status_code: int = None, retry_after: float = 0.0):
+        """
+        初始化API异常
+        
+        Args:
+            message: 错误信息
+            status_code: HTTP状态码，非HTTP错误时为None
+            retry_after: 服务端通过Retry-After建议的等待时间（秒）
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+    
+    @property
+    def retriable(self) -> bool:
+        """该错误是否值得重试"""
+        return self.status_code not in _NON_RETRIABLE_STATUS
+
+
+def _parse_retry_after(value: Optional[str]) -> float:
+    """解析Retry-After响应头，支持秒数和HTTP日期两种格式"""
+    from email.utils import parsedate_to_datetime
+    
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+# 共享的HTTP客户端，按(api_base, timeout)复用连接池，避免每个实例重复握手。
+# httpx导入较慢，只在真正创建客户端或发送请求时才导入
+_CLIENTS: Dict[tuple, "httpx.AsyncClient"] = {}
+
+# httpx的HTTP/2支持依赖h2包（httpx[http2]），未安装时退回HTTP/1.1；只检查不导入
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 已经预热过连接的客户端
+_PREWARMED: set = set()
+
+# 正在进行中的非流式请求任务，用于合并相同的并发请求
+_INFLIGHT: Dict[bytes, "asyncio.Task"] = {}
+
+# 每个提供商的并发请求数限制
+_SEMAPHORES: Dict[str, asyncio.Semaphore] = {}
+
+
+def _get_client(api_base: str, timeout: float) -> "httpx.AsyncClient":
+    """获取（或创建）指定API地址的共享HTTP客户端"""
+    import httpx
+    
+    key = (api_base, timeout)
+    client = _CLIENTS.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=api_base,
+            timeout=timeout,
+            http2=_HTTP2_AVAILABLE,
+            verify=True,
+            limits=httpx.Limits(
+                max_keepalive_connections=20,
+                max_connections=100,
+                keepalive_expiry=30
+            )
+        )
+        client.headers["Accept-Encoding"] = _preferred_encodings(
+            client.headers.get("Accept-Encoding", "")
+        )
+        _CLIENTS[key] = client
+    return client
+
+
+def _preferred_encodings(supported: str) -> str:
+    """
+    按解压速度重新排列httpx支持的压缩格式
+    
+    httpx只会声明已安装解码库的格式（br需要brotli，zstd需要zstandard），
+    这里只调整优先级，不会声明无法解码的格式
+    """
+    available = [e.strip() for e in supported.split(",") if e.strip()]
+    order = {name: i for i, name in enumerate(_ENCODING_PREFERENCE)}
+    available.sort(key=lambda e: order.get(e, len(order)))
+    return ", ".join(available)
+
+
+def install_event_loop_policy() -> bool:
+    """
+    在配置启用且已安装uvloop时，将uvloop设为asyncio的事件循环策略
+    
+    必须在asyncio.run()之前调用；已有运行中的事件循环时不做任何修改
+    
+    Returns:
+        是否成功启用uvloop
+    """
+    if not API_CONFIG.get("use_uvloop", False):
+        return False
+    
+    try:
+        asyncio.get_running_loop()
+        return False
+    except RuntimeError:
+        pass
+    
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def _finish_flight(flight_key: bytes, task: "asyncio.Task"):
+    """请求任务结束后将其移出合并表"""
+    if _INFLIGHT.get(flight_key) is task:
+        del _INFLIGHT[flight_key]
+    # 标记异常已被读取，避免所有调用方都已取消时asyncio输出警告
+    if not task.cancelled():
+        task.exception()
+
+
+async def shutdown_clients():
+    """关闭所有共享的HTTP客户端，应在程序退出前调用"""
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    _PREWARMED.clear()
+    for client in clients:
+        await client.aclose()
+
+
+class _ResponseCache:
+    """带过期时间的LRU缓存，用于保存非流式API响应"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 0):
+        """
+        初始化响应缓存
+        
+        Args:
+            maxsize: 最大缓存条目数
+            ttl: 缓存有效期（秒），0表示永不过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[bytes, tuple]" = OrderedDict()
+    
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """获取缓存的响应，未命中或已过期时返回None"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        
+        expires_at, value = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key: bytes, value: Dict[str, Any]):
+        """保存响应，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+
+
+_RESP_CACHE = _ResponseCache(
+    maxsize=API_CONFIG["response_cache"].get("maxsize", 1024),
+    ttl=API_CONFIG["response_cache"].get("ttl", 0)
+)
+
+
+def _cache_key(model: str, messages: List[Dict[str, str]], temperature: float,
+               max_tokens: int, extra: Dict[str, Any]) -> bytes:
+    """根据请求参数计算稳定的缓存键"""
+    payload = json.dumps(
+        {"m": model, "msgs": messages, "t": temperature, "mx": max_tokens, "x": extra},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+
+def _bigram_vector(text: str) -> Counter:
+    """将文本转换为字符二元组频次向量，对中文短句效果较好"""
+    text = "".join(text.lower().split())
+    if len(text) < 2:
+        return Counter(text)
+    return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+
+class _SemanticCache:
+    """
+    近似提示词缓存
+    
+    仅当前置消息与请求参数完全一致时，才比较最后一条用户消息的相似度，
+    避免在不同的对话上下文之间误用缓存
+    """
+    
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1000):
+        """
+        初始化近似缓存
+        
+        Args:
+            threshold: 余弦相似度阈值
+            max_entries: 最大缓存条目数
+        """
+        self.threshold = threshold
+        self._entries: deque = deque(maxlen=max_entries)
+    
+    @staticmethod
+    def _split(messages: List[Dict[str, str]]) -> Optional[tuple]:
+        """拆分出前置消息和最后一条用户消息"""
+        if not messages or messages[-1].get("role") != "user":
+            return None
+        return messages[:-1], messages[-1].get("content", "")
+    
+    def get(self, prefix_key: bytes, text: str) -> Optional[Dict[str, Any]]:
+        """查找足够相似的已缓存响应"""
+        vector = _bigram_vector(text)
+        norm = sum(v * v for v in vector.values()) ** 0.5
+        if not norm:
+            return None
+        
+        best_score, best_value = 0.0, None
+        for key, cached_vector, cached_norm, value in self._entries:
+            if key != prefix_key:
+                continue
+            dot = sum(count * cached_vector.get(gram, 0) for gram, count in vector.items())
+            score = dot / (norm * cached_norm)
+            if score > best_score:
+                best_score, best_value = score, value
+        
+        return best_value if best_score >= self.threshold else None
+    
+    def set(self, prefix_key: bytes, text: str, value: Dict[str, Any]):
+        """保存响应"""
+        vector = _bigram_vector(text)
+        norm = sum(v * v for v in vector.values()) ** 0.5
+        if norm:
+            self._entries.append((prefix_key, vector, norm, value))
+    
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+
+
+_SEMANTIC_CACHE = _SemanticCache(
+    threshold=API_CONFIG["semantic_cache"].get("threshold", 0.92),
+    max_entries=API_CONFIG["semantic_cache"].get("max_entries", 1000)
+)
+
+
+async def _iter_sse(response) -> AsyncGenerator[bytes, None]:
+    """
+    从原始字节流中切分SSE的data帧
+    
+    直接在bytearray上按换行切分，所有比较都在bytes上完成，避免逐行解码为字符串
+    
+    Yields:
+        去掉"data: "前缀后的帧内容（bytes），不包括结束帧"[DONE]"
+    """
+    buf = bytearray()
+    async for chunk in response.aiter_bytes(16384):
+        buf.extend(chunk)
+        while True:
+            nl = buf.find(b"\n")
+            if nl == -1:
+                break
+            line = bytes(buf[:nl])
+            del buf[:nl + 1]
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if line == _SSE_DONE:
+                continue
+            if line.startswith(_SSE_DATA_PREFIX):
+                yield line[_SSE_DATA_PREFIX_LEN:]
+    
+    # 处理没有以换行结尾的最后一帧
+    line = bytes(buf).rstrip(b"\r")
+    if line.startswith(_SSE_DATA_PREFIX) and line != _SSE_DONE:
+        yield line[_SSE_DATA_PREFIX_LEN:]
+
 
 class AICore:
     """
@@ -23,36 +344,75 @@ class AICore:
             provider: AI服务提供商名称，默认从配置文件读取
             api_key: API密钥，如果不提供则从配置或环境变量读取
         """
-        # 获取API配置
-        self.config = get_api_config(provider)
+        # 获取API配置（复制一份，避免修改全局配置）
+        self.config = dict(get_api_config(provider))
         
         # 设置API密钥（优先级：参数 > 环境变量 > 配置文件）
-        if api_key:
-            self.config["api_key"] = api_key
-        elif os.environ.get(f"{self.config['provider'].upper()}_API_KEY"):
-            self.config["api_key"] = os.environ.get(f"{self.config['provider'].upper()}_API_KEY")
+        env_key = os.environ.get(f"{self.config['provider'].upper()}_API_KEY")
+        self.config["api_key"] = api_key or env_key or self.config.get("api_key")
             
         # 验证API密钥是否存在
         if not self.config["api_key"]:
             raise ValueError(f"未提供{self.config['provider']}的API密钥，请在参数中提供或设置环境变量")
             
-        # 初始化HTTP客户端
-        self.client = httpx.AsyncClient(
-            timeout=self.config["timeout"],
-            base_url=self.config["api_base"]
-        )
+        # 获取共享的HTTP客户端
+        self.client = _get_client(self.config["api_base"], self.config["timeout"])
+        self._prewarm_task = None
+        
+        # 根据不同的AI服务提供商预先确定端点、请求头和请求体构造方法
+        self.provider = self.config["provider"]
+        if self.provider == "anthropic":
+            self._endpoint = "/messages"
+            self._static_headers = {
+                "Content-Type": "application/json",
+                "x-api-key": self.config["api_key"],
+                "anthropic-version": "2023-06-01"
+            }
+            self._build_request = self._build_anthropic_request
+        else:
+            # OpenAI及兼容格式（如DeepSeek）
+            self._endpoint = "/chat/completions"
+            self._static_headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.config['api_key']}"
+            }
+            self._build_request = self._build_openai_request
+        
+        # 同一提供商的所有实例共享并发限制
+        self._semaphore = _SEMAPHORES.get(self.provider)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.config.get("max_concurrency", 8))
+            _SEMAPHORES[self.provider] = self._semaphore
     
     async def __aenter__(self):
         """异步上下文管理器入口"""
+        # 在后台预热连接，让首次generate()跳过TCP/TLS握手
+        if id(self.client) not in _PREWARMED:
+            _PREWARMED.add(id(self.client))
+            self._prewarm_task = asyncio.ensure_future(self._prewarm())
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """异步上下文管理器退出"""
         await self.close()
     
+    async def _prewarm(self):
+        """向API地址发送一个轻量的HEAD请求以建立连接，忽略任何错误"""
+        import httpx
+        
+        try:
+            await self.client.head("/", timeout=5)
+        except httpx.HTTPError:
+            pass
+    
     async def close(self):
-        """关闭HTTP客户端连接"""
-        await self.client.aclose()
+        """
+        释放实例资源
+        
+        HTTP客户端在所有实例间共享，这里不会关闭它；
+        程序退出时请调用shutdown_clients()
+        """
+        pass
     
     async def generate(
         self, 
@@ -60,6 +420,7 @@ class AICore:
         stream: bool = None,
         temperature: float = 0.7,
         max_tokens: int = 1000,
+        cache: bool = None,
         **kwargs
     ) -> Union[Dict[str, Any], AsyncGenerator[str, None]]:
         """
@@ -70,119 +431,263 @@ class AICore:
             stream: 是否使用流式响应，默认使用配置文件设置
             temperature: 温度参数，控制随机性
             max_tokens: 最大生成的token数量
+            cache: 是否缓存非流式响应，默认仅在temperature为0时缓存；
+                   传入False可同时跳过精确缓存和近似缓存（例如依赖状态的回合）
             **kwargs: 其他API特定参数
             
         Returns:
-            如果stream为False，返回完整响应字典
+            如果stream为False，返回完整响应字典。该字典会在缓存和合并的并发调用之间共享，
+            调用方应将其视为只读，需要修改时请先复制
             如果stream为True，返回异步生成器，逐步生成内容
         """
         # 使用配置中的stream设置（如果未指定）
         if stream is None:
             stream = self.config.get("stream", False)
             
+        # 非流式请求先查询响应缓存
+        cache_key = None
+        semantic_key = None
+        if cache is None:
+            cache = temperature <= 0
+        if not stream and cache:
+            if API_CONFIG["response_cache"].get("enabled", True):
+                cache_key = _cache_key(self.config["model"], messages, temperature, max_tokens, kwargs)
+                cached = _RESP_CACHE.get(cache_key)
+                if cached is not None:
+                    return cached
+            
+            split = _SemanticCache._split(messages)
+            if split and API_CONFIG["semantic_cache"].get("enabled", False):
+                prefix, last_prompt = split
+                semantic_key = _cache_key(self.config["model"], prefix, temperature, max_tokens, kwargs)
+                cached = _SEMANTIC_CACHE.get(semantic_key, last_prompt)
+                if cached is not None:
+                    return cached
+            
         # 准备请求数据
-        request_data = {
+        request_data = self._build_request(messages, temperature, max_tokens, stream, kwargs)
+        
+        if stream:
+            response = await self._send(request_data, stream=True)
+            return self._handle_streaming_response(response, self.provider)
+        
+        # 相同的非流式请求正在进行时，直接等待其结果而不重复调用API。
+        # 请求在独立任务中执行，所有调用方都通过shield等待，
+        # 任何一个调用方被取消都不会影响其他调用方
+        flight_key = cache_key or _cache_key(self.config["model"], messages, temperature, max_tokens, kwargs)
+        task = _INFLIGHT.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._fetch(request_data, cache_key, semantic_key, last_prompt if semantic_key else None)
+            )
+            _INFLIGHT[flight_key] = task
+            task.add_done_callback(lambda done: _finish_flight(flight_key, done))
+        return await asyncio.shield(task)
+    
+    async def _fetch(
+        self,
+        request_data: Dict[str, Any],
+        cache_key: Optional[bytes],
+        semantic_key: Optional[bytes],
+        last_prompt: Optional[str]
+    ) -> Dict[str, Any]:
+        """发送非流式请求，解析响应并写入缓存"""
+        async with self._semaphore:
+            response = await self._send(request_data, stream=False)
+        try:
+            result = json_loads(response.content)
+        except json.JSONDecodeError as e:
+            # 状态码正常但响应体不是JSON（例如代理返回的HTML错误页），视为可重试的API错误
+            raise APIError(f"API响应不是有效的JSON: {str(e)}")
+        
+        if cache_key is not None:
+            _RESP_CACHE.set(cache_key, result)
+        if semantic_key is not None:
+            _SEMANTIC_CACHE.set(semantic_key, last_prompt, result)
+        return result
+    
+    async def _send(self, request_data: Dict[str, Any], stream: bool):
+        """
+        发送请求并检查HTTP状态
+        
+        Args:
+            request_data: 请求数据
+            stream: 是否以流式方式读取响应体
+            
+        Returns:
+            httpx响应对象
+            
+        Raises:
+            APIError: 请求失败时抛出
+        """
+        import httpx
+        
+        try:
+            request = self.client.build_request(
+                "POST",
+                self._endpoint,
+                content=json_dumps(request_data),
+                headers=self._static_headers
+            )
+            # 流式请求不预先读取响应体，边接收边解析
+            response = await self.client.send(request, stream=stream)
+            if stream and response.is_error:
+                await response.aread()
+                await response.aclose()
+            response.raise_for_status()
+            return response
+                
+        except httpx.HTTPStatusError as e:
+            error_detail = f"HTTP错误: {e.response.status_code}"
+            
+            # 只解析一次响应体，并截断过长的错误内容
+            raw = e.response.content
+            message = None
+            if "json" in e.response.headers.get("content-type", ""):
+                try:
+                    error_body = json_loads(raw)
+                    if isinstance(error_body, dict) and isinstance(error_body.get("error"), dict):
+                        message = error_body["error"].get("message")
+                except json.JSONDecodeError:
+                    pass
+            if not message:
+                message = raw[:_ERROR_BODY_LIMIT].decode("utf-8", "replace")
+            error_detail += f" - {message}"
+            
+            raise APIError(
+                f"API调用失败: {error_detail}",
+                status_code=e.response.status_code,
+                retry_after=_parse_retry_after(e.response.headers.get("retry-after"))
+            )
+        except Exception as e:
+            raise APIError(f"API调用发生异常: {str(e)}")
+    
+    def _build_openai_request(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        extra: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """构造OpenAI兼容格式的请求数据"""
+        return {
             "model": self.config["model"],
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
             "stream": stream,
-            **kwargs
+            **extra
         }
-        
-        # 准备请求头
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config['api_key']}"
+    
+    def _build_anthropic_request(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        stream: bool,
+        extra: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """构造Anthropic格式的请求数据（不传递额外参数）"""
+        return {
+            "model": self.config["model"],
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
         }
+    
+    async def _handle_streaming_response(self, response, provider):
+        """
+        处理流式响应
+        
+        模型经常逐个输出只有几个字符的增量，这里将它们合并后再向下游输出：
+        累计达到chunk_size的4倍、遇到换行或距上次输出超过flush_interval时输出一次。
+        等待下一个增量时带有超时，模型停顿时已缓冲的文本也会按时输出
+        """
+        flush_size = STREAM_CONFIG.get("chunk_size", 16) * 4
+        flush_interval = STREAM_CONFIG.get("flush_interval", 0.05)
+        loop = asyncio.get_running_loop()
+        
+        buf: List[str] = []
+        buf_len = 0
+        last_flush = loop.time()
+        
+        deltas = self._iter_deltas(response, provider)
+        # 读取下一个增量的任务；超时时不取消它，下一轮继续等待同一个任务
+        pending = None
         
-        # 根据不同的AI服务提供商调整请求
-        provider = self.config.get("provider", "openai")
-        if provider == "anthropic":
-            # 调整为Anthropic API格式
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": self.config['api_key'],
-                "anthropic-version": "2023-06-01"
-            }
-            request_data = {
-                "model": self.config["model"],
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "stream": stream
-            }
-        elif provider == "deepseek":
-            # DeepSeek使用与OpenAI兼容的API格式，只需修改headers
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.config['api_key']}"
-            }
-            # 保持OpenAI格式的请求数据
-            
-        # 发送请求
         try:
-            # 根据提供商确定API端点
-            endpoint = "/chat/completions"
-            if provider == "anthropic":
-                endpoint = "/messages"
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(deltas.__anext__())
                 
-            response = await self.client.post(
-                endpoint,
-                json=request_data,
-                headers=headers
-            )
-            response.raise_for_status()
-            
-            if stream:
-                return self._handle_streaming_response(response, provider)
-            else:
-                return response.json()
+                # 缓冲区为空时无需超时，一直等到下一个增量
+                timeout = max(0.0, last_flush + flush_interval - loop.time()) if buf else None
+                done, _ = await asyncio.wait((pending,), timeout=timeout)
                 
-        except httpx.HTTPStatusError as e:
-            error_detail = f"HTTP错误: {e.response.status_code}"
-            try:
-                error_body = e.response.json()
-                error_detail += f" - {error_body.get('error', {}).get('message', json.dumps(error_body))}"
-            except json.JSONDecodeError:
-                error_detail += f" - {e.response.text}"
+                if not done:
+                    # 模型停顿：输出已缓冲的文本
+                    yield "".join(buf)
+                    buf.clear()
+                    buf_len = 0
+                    last_flush = loop.time()
+                    continue
                 
-            raise Exception(f"API调用失败: {error_detail}")
-        except Exception as e:
-            raise Exception(f"API调用发生异常: {str(e)}")
+                task, pending = pending, None
+                try:
+                    delta = task.result()
+                except StopAsyncIteration:
+                    break
+                
+                buf.append(delta)
+                buf_len += len(delta)
+                
+                now = loop.time()
+                if buf_len >= flush_size or "\n" in delta or now - last_flush >= flush_interval:
+                    yield "".join(buf)
+                    buf.clear()
+                    buf_len = 0
+                    last_flush = now
+            
+            # 输出剩余内容
+            if buf:
+                yield "".join(buf)
+        finally:
+            if pending is not None:
+                pending.cancel()
+                # 等待读取任务真正结束后才能关闭生成器；asyncio.wait不会抛出任务自身的异常
+                await asyncio.wait((pending,))
+                if not pending.cancelled():
+                    pending.exception()
+            await deltas.aclose()
+            await response.aclose()
     
-    async def _handle_streaming_response(self, response, provider):
-        """处理流式响应"""
+    async def _iter_deltas(self, response, provider):
+        """逐个解析流式响应中的文本增量"""
+        # 热循环中使用局部变量引用解析函数，orjson可直接解析bytes且比标准库快数倍
+        loads = json_loads
+        
         if provider == "openai" or provider == "deepseek":  # DeepSeek 使用与 OpenAI 兼容的流式格式
-            async for line in response.aiter_lines():
-                if not line.strip() or line.strip() == "data: [DONE]":
+            async for payload in _iter_sse(response):
+                try:
+                    data = loads(payload)
+                    delta = data.get("choices", [{}])[0].get("delta", {})
+                    content = delta.get("content", "")
+                    if content:
+                        yield content
+                except json.JSONDecodeError:
                     continue
-                    
-                if line.startswith("data: "):
-                    json_str = line[6:]  # 去掉 "data: " 前缀
-                    try:
-                        data = json.loads(json_str)
-                        delta = data.get("choices", [{}])[0].get("delta", {})
-                        content = delta.get("content", "")
-                        if content:
-                            yield content
-                    except json.JSONDecodeError:
-                        continue
         elif provider == "anthropic":
             # Anthropic的流式响应处理
-            async for line in response.aiter_lines():
-                if not line.strip():
-                    continue
-                    
+            async for payload in _iter_sse(response):
                 try:
-                    if line.startswith("data: "):
-                        json_str = line[6:]  # 去掉 "data: " 前缀
-                        data = json.loads(json_str)
-                        if data.get("type") == "content_block_delta":
-                            delta = data.get("delta", {})
-                            text = delta.get("text", "")
-                            if text:
-                                yield text
+                    data = loads(payload)
+                    if data.get("type") == "content_block_delta":
+                        delta = data.get("delta", {})
+                        text = delta.get("text", "")
+                        if text:
+                            yield text
                 except json.JSONDecodeError:
                     continue
     
@@ -204,6 +709,10 @@ class AICore:
             
         Returns:
             与generate方法返回值相同
+            
+        Raises:
+            APIError: 遇到不可重试的错误（如400/401/403）时立即抛出
+            Exception: 达到最大重试次数后仍然失败
         """
         if max_retries is None:
             max_retries = self.config.get("max_retries", 3)
@@ -214,51 +723,29 @@ class AICore:
         while retries <= max_retries:
             try:
                 return await self.generate(messages, **kwargs)
-            except Exception as e:
+            except APIError as e:
+                # 请求或认证错误重试也不会成功，直接抛出
+                if not e.retriable:
+                    raise
+                    
                 last_error = e
                 retries += 1
                 
                 if retries > max_retries:
                     break
                     
-                # 指数退避策略
-                wait_time = retry_delay * (2 ** (retries - 1))
+                # 带完全抖动的指数退避，避免多个客户端同时重试；同时遵守服务端的Retry-After
+                backoff = retry_delay * (2 ** (retries - 1))
+                wait_time = max(e.retry_after, random.uniform(0, backoff))
                 await asyncio.sleep(wait_time)
         
         raise Exception(f"达到最大重试次数({max_retries})后仍然失败: {str(last_error)}")
 
 
-# 辅助函数，创建一个简单的消息列表
-def create_messages(
-    system_prompt: str, 
-    user_prompt: str, 
-    conversation_history: List[Dict[str, str]] = None
-) -> List[Dict[str, str]]:
-    """
-    创建格式化的消息列表
-    
-    Args:
-        system_prompt: 系统提示词
-        user_prompt: 用户提示词
-        conversation_history: 对话历史记录
-        
-    Returns:
-        格式化的消息列表
-    """
-    messages = [{"role": "system", "content": system_prompt}]
-    
-    if conversation_history:
-        messages.extend(conversation_history)
-        
-    messages.append({"role": "user", "content": user_prompt})
-    
-    return messages
-
-
 # 示例用法
 async def example_usage():
     """示例用法"""
-    from config import PROMPT_CONFIG
+    from config import SYSTEM_PROMPT_CANONICAL
     
     # 设置环境变量（实际应用中应通过更安全的方式设置）
     os.environ["OPENAI_API_KEY"] = "你的API密钥"
@@ -266,7 +753,7 @@ async def example_usage():
     # 创建AI接口实例
     async with AICore() as ai:
         # 准备提示词
-        system_prompt = PROMPT_CONFIG["system_prompt"]
+        system_prompt = SYSTEM_PROMPT_CANONICAL
         user_prompt = "我是一位冒险家，刚刚进入一个神秘的洞穴。描述我看到了什么，并给我三个可能的行动选择。"
         
         # 创建消息列表
@@ -276,4 +763,6 @@ async def example_usage():
         print("开始生成内容...")
         async for chunk in await ai.generate_with_retry(messages, stream=True):
             print(chunk, end="", flush=True)
-        print("\n\n生成完成!") 
\ No newline at end of file
+        print("\n\n生成完成!")
+    
+    await shutdown_clients()
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""
+消息构造模块：创建发送给大模型的消息列表，不依赖任何网络库
+"""
+
+from typing import Dict, List
+
+
+# 辅助函数，创建一个简单的消息列表
+def create_messages(
+    system_prompt: str, 
+    user_prompt: str, 
+    conversation_history: List[Dict[str, str]] = None,
+    dynamic_context: str = None
+) -> List[Dict[str, str]]:
+    """
+    创建格式化的消息列表
+    
+    消息按"系统提示词 -> 对话历史 -> 动态上下文 -> 用户提示词"排列，
+    让每轮不变的部分尽量构成最长的公共前缀，以命中服务商的提示词缓存
+    
+    Args:
+        system_prompt: 系统提示词，建议使用config.SYSTEM_PROMPT_CANONICAL
+        user_prompt: 用户提示词
+        conversation_history: 对话历史记录，可以是列表或元组
+        dynamic_context: 每轮变化的上下文信息（如游戏状态），作为单独的消息发送
+        
+    Returns:
+        格式化的消息列表
+    """
+    history = conversation_history or ()
+    history_len = len(history)
+    
+    # 预先分配好列表长度，避免逐条追加时反复扩容
+    messages = [None] * (history_len + (3 if dynamic_context else 2))
+    messages[0] = {"role": "system", "content": system_prompt}
+    messages[1:history_len + 1] = history
+    
+    if dynamic_context:
+        messages[history_len + 1] = {"role": "user", "content": dynamic_context}
+        
+    messages[-1] = {"role": "user", "content": user_prompt}
+    
+    return messages
@@ -2,11 +2,18 @@
 配置文件：管理API密钥和系统设置
 """
 
+import textwrap
+from functools import lru_cache
+from types import MappingProxyType
+
 # API配置
 API_CONFIG = {
     # 默认使用的AI服务提供商
     "default_provider": "openai",
     
+    # 已安装uvloop时使用它作为事件循环（Windows上不可用）
+    "use_uvloop": True,
+    
     # 支持的AI服务提供商配置
     "providers": {
         "openai": {
@@ -15,6 +22,7 @@ API_CONFIG = {
             "model": "gpt-4-turbo",
             "timeout": 60,
             "max_retries": 3,
+            "max_concurrency": 8,  # 非流式请求的最大并发数
             "stream": True,
         },
         "anthropic": {
@@ -23,6 +31,7 @@ API_CONFIG = {
             "model": "claude-3-opus-20240229",
             "timeout": 60,
             "max_retries": 3,
+            "max_concurrency": 8,  # 非流式请求的最大并发数
             "stream": True,
         },
         "deepseek": {
@@ -31,9 +40,24 @@ API_CONFIG = {
             "model": "deepseek-chat",  # 默认使用 DeepSeek-V3
             "timeout": 60,
             "max_retries": 3,
+            "max_concurrency": 8,  # 非流式请求的最大并发数
             "stream": True,
         },
         # 可扩展添加其他AI服务提供商
+    },
+    
+    # 非流式响应的精确匹配缓存
+    "response_cache": {
+        "enabled": True,
+        "maxsize": 1024,
+        "ttl": 3600,  # 缓存有效期（秒），0表示永不过期
+    },
+    
+    # 近似提示词缓存：除最后一条用户消息外完全相同，且最后一条消息足够相似时复用响应
+    "semantic_cache": {
+        "enabled": False,
+        "threshold": 0.92,  # 相似度阈值（0~1）
+        "max_entries": 1000,
     }
 }
 
@@ -83,17 +107,32 @@ PROMPT_CONFIG = {
     """
 }
 
+def canonicalize_prompt(text: str) -> str:
+    """
+    规范化提示词文本：去除公共缩进、行尾空白和首尾空行
+    
+    保证同一提示词每次发送的内容完全一致，便于命中服务商的提示词缓存
+    """
+    lines = textwrap.dedent(text).strip().splitlines()
+    return "\n".join(line.rstrip() for line in lines)
+
+
+# 规范化后的系统提示词，作为每次请求中固定不变的前缀
+SYSTEM_PROMPT_CANONICAL = canonicalize_prompt(PROMPT_CONFIG["system_prompt"])
+
 # 流处理配置
 STREAM_CONFIG = {
     "buffer_size": 1024,
     "chunk_size": 16,
-    "decode_format": "utf-8"
+    "decode_format": "utf-8",
+    "flush_interval": 0.05  # 流式输出合并的最长等待时间（秒）
 }
 
 # 游戏集成配置
 GAME_CONFIG = {
     "save_directory": "./saves",
     "log_directory": "./logs",
+    "history_window": 10,  # 发送给AI的最近对话轮数（每轮含用户与AI各一条），0表示不限制
     "debug_mode": True
 }
 
@@ -106,15 +145,21 @@ LOG_CONFIG = {
     "backup_count": 3
 }
 
+@lru_cache(maxsize=16)
 def get_api_config(provider=None):
-    """获取指定提供商的API配置"""
+    """
+    获取指定提供商的API配置
+    
+    返回只读的配置副本（包含"provider"字段），结果会被缓存；
+    运行时修改API_CONFIG后需调用get_api_config.cache_clear()
+    """
     if provider is None:
         provider = API_CONFIG["default_provider"]
     
     if provider not in API_CONFIG["providers"]:
         raise ValueError(f"不支持的AI服务提供商: {provider}")
     
-    return API_CONFIG["providers"][provider]
+    return MappingProxyType({**API_CONFIG["providers"][provider], "provider": provider})
 
 def get_prompt_format(format_type):
     """获取指定类型的提示词格式"""
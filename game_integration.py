@@ -3,26 +3,73 @@
 """
 
 import os
-import json
 import asyncio
+import hashlib
 import logging
+import threading
 from typing import Dict, List, Any, Optional, Callable, Union
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, fields
 
-from ai_core import AICore, create_messages
+from ai_core import AICore, create_messages, shutdown_clients, install_event_loop_policy
 from prompt_manager import PromptManager
 from stream_processor import StreamProcessor
 from output_formatter import OutputFormatter
 from config import GAME_CONFIG, LOG_CONFIG, PROMPT_CONFIG
+from json_utils import json_dumps_pretty, json_loads
 
-# 设置日志
-logging.basicConfig(
-    level=getattr(logging, LOG_CONFIG["level"]),
-    format=LOG_CONFIG["format"],
-    filename=LOG_CONFIG.get("file")
-)
 logger = logging.getLogger("game_integration")
 
+# 日志是否已配置
+_LOGGING_CONFIGURED = False
+
+
+def configure_logging():
+    """
+    按LOG_CONFIG配置日志，重复调用无副作用
+    
+    导入本模块不会配置日志或打开日志文件，由程序入口调用此函数
+    """
+    global _LOGGING_CONFIGURED
+    if _LOGGING_CONFIGURED:
+        return
+    logging.basicConfig(
+        level=getattr(logging, LOG_CONFIG["level"]),
+        format=LOG_CONFIG["format"],
+        filename=LOG_CONFIG.get("file")
+    )
+    _LOGGING_CONFIGURED = True
+
+# 系统消息中的位置更新前缀
+_LOCATION_PREFIX = "发现新地点："
+
+# 内容类型到GameSession默认回调方法名的映射
+_DEFAULT_CALLBACKS = {
+    "narrative": "_on_narrative",
+    "action": "_on_action",
+    "option": "_on_option",
+    "system": "_on_system",
+    "error": "_on_error"
+}
+
+
+def _fast_construct(cls, data: Dict[str, Any], field_names: frozenset):
+    """
+    直接填充实例__dict__来创建数据对象，跳过__init__和__post_init__
+    
+    仅当data恰好包含全部字段且没有None值（即由to_dict生成）时才走快速路径，
+    否则退回from_dict，保证默认值处理不变
+    
+    Args:
+        cls: 数据类
+        data: 字段字典，所有权转移给新对象
+        field_names: 该数据类的字段名集合
+    """
+    if data.keys() != field_names or None in data.values():
+        return cls.from_dict(data)
+    obj = cls.__new__(cls)
+    obj.__dict__.update(data)
+    return obj
+
 @dataclass
 class Character:
     """游戏角色数据结构"""
@@ -49,13 +96,32 @@ class Character:
             self.skills = {}
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        return asdict(self)
+        """
+        转换为字典（嵌套容器只做浅拷贝，比asdict的递归深拷贝快得多）
+        
+        GameSession按脏标记缓存提示词中的此结果，绕过会话方法直接修改后需调用invalidate_prompt_cache()
+        """
+        return {
+            "name": self.name,
+            "health": self.health,
+            "max_health": self.max_health,
+            "mana": self.mana,
+            "max_mana": self.max_mana,
+            "level": self.level,
+            "experience": self.experience,
+            "attributes": dict(self.attributes),
+            "skills": dict(self.skills)
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Character':
         """从字典创建角色"""
         return cls(**data)
+    
+    @classmethod
+    def fast_from_dict(cls, data: Dict[str, Any]) -> 'Character':
+        """从to_dict()生成的字典快速创建角色，用于加载存档"""
+        return _fast_construct(cls, data, _CHAR_FIELDS)
 
 
 @dataclass
@@ -74,13 +140,29 @@ class Item:
             self.properties = {}
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        return asdict(self)
+        """
+        转换为字典（嵌套容器只做浅拷贝）
+        
+        GameSession按脏标记缓存提示词中的此结果，绕过会话方法直接修改后需调用invalidate_prompt_cache()
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "type": self.type,
+            "quantity": self.quantity,
+            "properties": dict(self.properties)
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Item':
         """从字典创建物品"""
         return cls(**data)
+    
+    @classmethod
+    def fast_from_dict(cls, data: Dict[str, Any]) -> 'Item':
+        """从to_dict()生成的字典快速创建物品，用于加载存档"""
+        return _fast_construct(cls, data, _ITEM_FIELDS)
 
 
 @dataclass
@@ -104,17 +186,82 @@ class GameState:
             self.events_triggered = []
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        return asdict(self)
+        """
+        转换为字典（嵌套容器只做浅拷贝）
+        
+        GameSession按脏标记缓存提示词中的此结果，绕过会话方法直接修改后需调用invalidate_prompt_cache()
+        """
+        return {
+            "location": self.location,
+            "scenes_visited": list(self.scenes_visited),
+            "quest_flags": dict(self.quest_flags),
+            "variables": dict(self.variables),
+            "events_triggered": list(self.events_triggered)
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'GameState':
         """从字典创建游戏状态"""
         return cls(**data)
+    
+    @classmethod
+    def fast_from_dict(cls, data: Dict[str, Any]) -> 'GameState':
+        """从to_dict()生成的字典快速创建游戏状态，用于加载存档"""
+        return _fast_construct(cls, data, _STATE_FIELDS)
+
+
+# 各数据类的字段名，用于过滤update_character/update_game_state中的键及快速加载存档
+_CHAR_FIELDS = frozenset(f.name for f in fields(Character))
+_STATE_FIELDS = frozenset(f.name for f in fields(GameState))
+_ITEM_FIELDS = frozenset(f.name for f in fields(Item))
+
+
+def _write_save_file(save_path: str, save_data: Dict[str, Any], last_digest: Optional[bytes]) -> Optional[bytes]:
+    """
+    序列化并写入存档文件，可在工作线程中调用，不访问会话状态
+    
+    先写入临时文件再用os.replace替换，读取方不会看到写了一半的存档
+    
+    Args:
+        save_path: 存档文件路径
+        save_data: 存档数据快照
+        last_digest: 上次写入该路径的内容摘要
+    
+    Returns:
+        写入内容的摘要；内容与上次相同而跳过写盘时返回None
+    """
+    data = json_dumps_pretty(save_data)
+    
+    # 内容与上次写入该路径时相同则跳过写盘
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    if digest == last_digest and os.path.exists(save_path):
+        logger.debug(f"存档内容未变化，跳过写入: {save_path}")
+        return None
+    
+    # 临时文件名带线程标识，同时写入同一存档的线程互不干扰；不以.json结尾，不会出现在存档列表中
+    temp_path = f"{save_path}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, save_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    
+    logger.info(f"游戏已保存: {save_path}")
+    return digest
 
 
 class GameSession:
-    """游戏会话，管理游戏状态和与AI的交互"""
+    """
+    游戏会话，管理游戏状态和与AI的交互
+    
+    提示词中的角色、游戏状态和物品栏按脏标记缓存。直接修改character、game_state、
+    inventory或物品对象后，需调用invalidate_prompt_cache()才会反映到下一轮提示词；存档总是保存最新状态
+    """
     
     def __init__(self, 
                  character: Character = None, 
@@ -138,17 +285,43 @@ class GameSession:
         self.character = character or Character(name="冒险者")
         self.game_state = game_state or GameState(location="起始位置")
         self.inventory: List[Item] = []
+        self._inventory_by_id: Dict[str, Item] = {}
         self.conversation_history: List[Dict[str, str]] = []
         
+        # 提示词上下文缓存：数据未变化时复用上一轮的序列化结果。
+        # 只有add_item、remove_item、update_*等方法会标记变化，直接修改对象后需调用invalidate_prompt_cache()
+        self._char_cache: Optional[tuple] = None
+        self._state_cache: Optional[tuple] = None
+        self._inv_cache: Optional[List[Dict[str, Any]]] = None
+        self._char_dirty = self._state_dirty = self._inv_dirty = True
+        # 各部分的JSON文本缓存：部分名 -> (上下文字典, JSON文本)
+        self._section_texts: Dict[str, tuple] = {}
+        
         # 设置AI工具
         self.ai_provider = ai_provider
         self.api_key = api_key
-        self.prompt_manager = PromptManager()
+        self.history_window = GAME_CONFIG.get("history_window", 10)
+        # 提示词中的"最近对话"最多5条，且不超过发送给AI的历史窗口
+        history_tail_size = min(5, 2 * self.history_window) if self.history_window > 0 else 5
+        self.prompt_manager = PromptManager(history_tail_size=history_tail_size)
+        self._system_prompt = self.prompt_manager.get_system_prompt()
         self.save_directory = save_directory or GAME_CONFIG.get("save_directory", "./saves")
         
         # 确保存档目录存在
         if not os.path.exists(self.save_directory):
             os.makedirs(self.save_directory)
+        
+        # 尚未完成的后台保存任务
+        self._pending_saves: set = set()
+        # 存档列表缓存：(存档目录mtime_ns, 存档名称列表)
+        self._saves_cache: Optional[tuple] = None
+        # 每个存档路径最近一次写入内容的摘要
+        self._last_save_hashes: Dict[str, bytes] = {}
+        # 每个存档路径的写入锁，保证同一存档的后台保存按调度顺序依次写入
+        self._save_locks: Dict[str, asyncio.Lock] = {}
+        
+        # 会话期间复用的AI接口，在async with中创建
+        self._ai: Optional[AICore] = None
             
         # 设置回调函数
         self.callbacks = callbacks or {}
@@ -164,22 +337,30 @@ class GameSession:
     
     def _setup_callbacks(self):
         """设置流处理器的回调函数"""
-        # 首先设置从callbacks传入的回调
-        for content_type, callback in self.callbacks.items():
-            self.stream_processor.register_callback(content_type, callback)
-            
-        # 然后设置默认回调（如果没有对应的自定义回调）
+        # 默认回调在前，传入的callbacks覆盖同类型的默认回调
         default_callbacks = {
-            "narrative": self._on_narrative,
-            "action": self._on_action,
-            "option": self._on_option,
-            "system": self._on_system,
-            "error": self._on_error
+            content_type: getattr(self, method_name)
+            for content_type, method_name in _DEFAULT_CALLBACKS.items()
         }
-        
-        for content_type, callback in default_callbacks.items():
-            if content_type not in self.callbacks:
-                self.stream_processor.register_callback(content_type, callback)
+        for content_type, callback in {**default_callbacks, **self.callbacks}.items():
+            self.stream_processor.register_callback(content_type, callback)
+    
+    async def __aenter__(self):
+        """异步上下文管理器入口，创建整个会话共用的AI接口"""
+        try:
+            self._ai = await AICore(provider=self.ai_provider, api_key=self.api_key).__aenter__()
+        except ValueError as e:
+            # 缺少API密钥时不阻止会话启动，错误将在每轮调用时返回给玩家
+            logger.warning(f"无法创建AI接口: {str(e)}")
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """异步上下文管理器退出，等待后台保存完成并释放AI接口"""
+        if self._pending_saves:
+            await asyncio.gather(*self._pending_saves, return_exceptions=True)
+        if self._ai is not None:
+            ai, self._ai = self._ai, None
+            await ai.__aexit__(exc_type, exc_val, exc_tb)
     
     def _on_narrative(self, content: Dict[str, Any]):
         """处理叙述内容"""
@@ -201,10 +382,12 @@ class GameSession:
         system_content = content['content']
         
         # 示例：检测位置更新
-        if "发现新地点：" in system_content:
-            new_location = system_content.split("发现新地点：")[1].strip()
+        _, sep, rest = system_content.partition(_LOCATION_PREFIX)
+        if sep:
+            new_location = rest.strip()
             self.game_state.location = new_location
             self.game_state.scenes_visited.append(new_location)
+            self._state_dirty = True
             logger.info(f"更新位置: {new_location}")
             
         # 处理其他系统指令...
@@ -213,6 +396,60 @@ class GameSession:
         """处理错误内容"""
         logger.error(f"错误: {content['content']}")
     
+    def invalidate_prompt_cache(self):
+        """直接修改character、game_state、inventory或其中的物品后调用，使下一轮提示词重新生成上下文（存档总是读取最新状态）"""
+        self._char_dirty = self._state_dirty = self._inv_dirty = True
+    
+    def invalidate_system_prompt(self):
+        """修改prompt_manager的系统提示词后调用，重新读取缓存的系统提示词"""
+        self._system_prompt = self.prompt_manager.get_system_prompt()
+    
+    def _prompt_context(self) -> tuple:
+        """
+        获取角色、游戏状态和物品栏的字典形式，只重新序列化发生变化的部分
+        
+        Returns:
+            (角色字典, 游戏状态字典, 物品字典列表)
+        """
+        # 同时比较对象身份，防止对象被整体替换后仍使用旧缓存
+        if self._char_dirty or self._char_cache[0] is not self.character:
+            self._char_cache = (self.character, self.character.to_dict())
+            self._char_dirty = False
+        if self._state_dirty or self._state_cache[0] is not self.game_state:
+            self._state_cache = (self.game_state, self.game_state.to_dict())
+            self._state_dirty = False
+        if self._inv_dirty:
+            self._inv_cache = [item.to_dict() for item in self.inventory]
+            self._inv_dirty = False
+        return self._char_cache[1], self._state_cache[1], self._inv_cache
+    
+    def _section_text(self, section: str, data: Any) -> Optional[str]:
+        """
+        获取上下文某一部分的JSON文本，数据为空时返回None
+        
+        _prompt_context只在数据变化时重建字典，且字典创建后不再被修改，
+        因此同一字典对象再次出现时可以直接复用上次的文本
+        """
+        if not data:
+            return None
+        cached = self._section_texts.get(section)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+        text = json_dumps_pretty(data).decode("utf-8")
+        self._section_texts[section] = (data, text)
+        return text
+    
+    def _recent_history(self) -> tuple:
+        """获取最近history_window轮对话的只读快照"""
+        if self.history_window <= 0:
+            return tuple(self.conversation_history)
+        return tuple(self.conversation_history[-2 * self.history_window:])
+    
+    def _append_history(self, role: str, content: str):
+        """追加一条对话，同时更新提示词管理器中预先格式化的最近对话"""
+        self.conversation_history.append({"role": role, "content": content})
+        self.prompt_manager.append_history(role, content)
+    
     async def process_input(self, user_input: str) -> Dict[str, Any]:
         """
         处理用户输入并获取AI响应
@@ -223,48 +460,52 @@ class GameSession:
         Returns:
             处理后的游戏输出
         """
+        # 只发送最近的若干轮对话，保持提示词长度有界；
+        # 快照为元组，之后追加到conversation_history不会影响已构建的提示词
+        history = self._recent_history()
+        
         # 创建游戏提示词
-        game_prompt = self.prompt_manager.create_game_prompt(
-            user_input=user_input,
-            game_state=self.game_state.to_dict(),
-            inventory=[item.to_dict() for item in self.inventory],
-            character=self.character.to_dict(),
-            conversation_history=self.conversation_history
+        character, game_state, inventory = self._prompt_context()
+        game_prompt = self.prompt_manager.assemble_game_prompt(
+            user_input,
+            state_info=self._section_text("game_state", game_state),
+            inventory_info=self._section_text("inventory", inventory),
+            character_info=self._section_text("character", character)
         )
         
         # 创建消息列表
-        system_prompt = self.prompt_manager.get_system_prompt()
-        messages = create_messages(system_prompt, game_prompt, self.conversation_history)
+        messages = create_messages(self._system_prompt, game_prompt, history)
         
         # 记录当前用户输入到对话历史
-        self.conversation_history.append({"role": "user", "content": user_input})
+        self._append_history("user", user_input)
         
         # 调用AI接口
         try:
-            async with AICore(provider=self.ai_provider, api_key=self.api_key) as ai:
-                # 获取AI响应
-                response_stream = await ai.generate_with_retry(messages, stream=True)
-                
-                # 处理流式响应
-                result = await self.stream_processor.process_stream(response_stream)
-                
-                # 获取完整的AI输出
-                all_content = self.stream_processor.get_all_content()
-                formatted_output = self.formatter.format_game_output(all_content)
-                
-                # 组合所有文本内容以保存到对话历史
-                ai_content = ""
-                for segment in all_content:
-                    if segment["type"] == "narrative":
-                        ai_content += segment["content"] + " "
-                
-                # 记录AI响应到对话历史
-                self.conversation_history.append({"role": "assistant", "content": ai_content.strip()})
-                
-                return formatted_output
+            # 会话已进入时复用长期持有的AICore，否则为本轮单独创建
+            ai = self._ai or AICore(provider=self.ai_provider, api_key=self.api_key)
+            
+            # 获取AI响应
+            response_stream = await ai.generate_with_retry(messages, stream=True)
+            
+            # 处理流式响应
+            result = await self.stream_processor.process_stream(response_stream)
+            
+            # 获取完整的AI输出
+            all_content = self.stream_processor.get_all_content()
+            formatted_output = self.formatter.format_game_output(all_content)
+            
+            # 组合所有文本内容以保存到对话历史
+            ai_content = " ".join(
+                segment["content"] for segment in all_content if segment["type"] == "narrative"
+            )
+            
+            # 记录AI响应到对话历史
+            self._append_history("assistant", ai_content.strip())
+            
+            return formatted_output
                 
         except Exception as e:
-            logger.error(f"调用AI时发生错误: {str(e)}")
+            logger.exception("调用AI时发生错误")
             return {
                 "errors": [f"与AI通信时发生错误: {str(e)}"],
                 "narrative": ["系统暂时无法响应，请稍后再试。"],
@@ -287,14 +528,17 @@ class GameSession:
             item = Item.from_dict(item)
             
         # 检查是否已有该物品，如果有则增加数量
-        for existing_item in self.inventory:
-            if existing_item.id == item.id:
-                existing_item.quantity += item.quantity
-                logger.info(f"增加物品数量: {item.name} (x{item.quantity})")
-                return existing_item
+        existing_item = self._inventory_by_id.get(item.id)
+        if existing_item is not None:
+            existing_item.quantity += item.quantity
+            self._inv_dirty = True
+            logger.info(f"增加物品数量: {item.name} (x{item.quantity})")
+            return existing_item
         
         # 如果没有，则添加新物品
         self.inventory.append(item)
+        self._inventory_by_id[item.id] = item
+        self._inv_dirty = True
         logger.info(f"添加新物品: {item.name} (x{item.quantity})")
         return item
     
@@ -309,21 +553,22 @@ class GameSession:
         Returns:
             移除的物品，如果物品不存在或数量不足则返回None
         """
-        for i, item in enumerate(self.inventory):
-            if item.id == item_id:
-                if item.quantity <= quantity:
-                    # 如果要移除的数量大于等于物品数量，则移除整个物品
-                    removed_item = self.inventory.pop(i)
-                    logger.info(f"移除物品: {removed_item.name}")
-                    return removed_item
-                else:
-                    # 否则减少物品数量
-                    item.quantity -= quantity
-                    logger.info(f"减少物品数量: {item.name} (剩余: {item.quantity})")
-                    return item
-        
-        logger.warning(f"尝试移除不存在的物品: {item_id}")
-        return None
+        item = self._inventory_by_id.get(item_id)
+        if item is None:
+            logger.warning(f"尝试移除不存在的物品: {item_id}")
+            return None
+        
+        self._inv_dirty = True
+        if item.quantity <= quantity:
+            # 如果要移除的数量大于等于物品数量，则移除整个物品
+            del self._inventory_by_id[item_id]
+            self.inventory.remove(item)
+            logger.info(f"移除物品: {item.name}")
+        else:
+            # 否则减少物品数量
+            item.quantity -= quantity
+            logger.info(f"减少物品数量: {item.name} (剩余: {item.quantity})")
+        return item
     
     def update_character(self, updates: Dict[str, Any]):
         """
@@ -332,17 +577,20 @@ class GameSession:
         Args:
             updates: 要更新的属性字典
         """
-        char_dict = self.character.to_dict()
+        # 直接修改现有对象，只触及变化的字段
+        character = self.character
         
         for key, value in updates.items():
-            if key in char_dict:
-                # 处理嵌套字典
-                if isinstance(char_dict[key], dict) and isinstance(value, dict):
-                    char_dict[key].update(value)
-                else:
-                    char_dict[key] = value
-        
-        self.character = Character.from_dict(char_dict)
+            if key not in _CHAR_FIELDS:
+                continue
+            current = getattr(character, key)
+            # 处理嵌套字典
+            if isinstance(current, dict) and isinstance(value, dict):
+                current.update(value)
+            else:
+                setattr(character, key, value)
+        
+        self._char_dirty = True
         logger.info(f"更新角色属性: {updates}")
     
     def update_game_state(self, updates: Dict[str, Any]):
@@ -352,20 +600,23 @@ class GameSession:
         Args:
             updates: 要更新的状态字典
         """
-        state_dict = self.game_state.to_dict()
+        # 直接修改现有对象，只触及变化的字段
+        game_state = self.game_state
         
         for key, value in updates.items():
-            if key in state_dict:
-                # 处理嵌套字典
-                if isinstance(state_dict[key], dict) and isinstance(value, dict):
-                    state_dict[key].update(value)
-                # 处理列表
-                elif isinstance(state_dict[key], list) and isinstance(value, list):
-                    state_dict[key].extend(value)
-                else:
-                    state_dict[key] = value
-        
-        self.game_state = GameState.from_dict(state_dict)
+            if key not in _STATE_FIELDS:
+                continue
+            current = getattr(game_state, key)
+            # 处理嵌套字典
+            if isinstance(current, dict) and isinstance(value, dict):
+                current.update(value)
+            # 处理列表
+            elif isinstance(current, list) and isinstance(value, list):
+                current.extend(value)
+            else:
+                setattr(game_state, key, value)
+        
+        self._state_dirty = True
         logger.info(f"更新游戏状态: {updates}")
     
     def save_game(self, save_name: str = "autosave") -> str:
@@ -378,23 +629,92 @@ class GameSession:
         Returns:
             存档文件路径
         """
-        save_data = {
-            "character": self.character.to_dict(),
-            "game_state": self.game_state.to_dict(),
-            "inventory": [item.to_dict() for item in self.inventory],
-            "conversation_history": self.conversation_history
-        }
+        save_path = os.path.join(self.save_directory, f"{save_name}.json")
+        digest = _write_save_file(save_path, self._build_save_data(), self._last_save_hashes.get(save_path))
+        self._record_save(save_path, digest)
+        return save_path
+    
+    async def save_game_async(self, save_name: str = "autosave") -> str:
+        """
+        异步保存游戏，序列化与磁盘写入在线程池中执行，不阻塞事件循环
         
-        # 构建存档文件路径
+        Args:
+            save_name: 存档名称
+            
+        Returns:
+            存档文件路径
+        """
+        # 快照在事件循环线程中生成，之后的状态修改不会影响本次存档
         save_path = os.path.join(self.save_directory, f"{save_name}.json")
+        return await self._save_in_executor(save_path, self._build_save_data())
+    
+    def save_game_nowait(self, save_name: str = "autosave") -> asyncio.Task:
+        """
+        调度后台保存并立即返回，写盘与后续AI请求并行进行
         
-        # 写入存档
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(save_data, ensure_ascii=False, indent=2, fp=f)
+        Args:
+            save_name: 存档名称
             
-        logger.info(f"游戏已保存: {save_path}")
+        Returns:
+            保存任务
+        """
+        # 立即生成快照，存档内容对应调用时的游戏状态
+        save_path = os.path.join(self.save_directory, f"{save_name}.json")
+        task = asyncio.get_running_loop().create_task(
+            self._save_in_executor(save_path, self._build_save_data())
+        )
+        # 持有任务引用，避免任务在完成前被回收
+        self._pending_saves.add(task)
+        task.add_done_callback(self._on_save_done)
+        return task
+    
+    async def _save_in_executor(self, save_path: str, save_data: Dict[str, Any]) -> str:
+        """在线程池中写入存档，同一路径的写入依次进行"""
+        lock = self._save_locks.get(save_path)
+        if lock is None:
+            lock = self._save_locks[save_path] = asyncio.Lock()
+        await lock.acquire()
+        
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            None, _write_save_file, save_path, save_data, self._last_save_hashes.get(save_path)
+        )
+        
+        def on_written(done: "asyncio.Future"):
+            # 在事件循环线程中更新共享状态；写入真正结束后才释放锁，
+            # 即使等待方被取消，下一次写入也不会与本次重叠
+            try:
+                if not done.cancelled() and done.exception() is None:
+                    self._record_save(save_path, done.result())
+            finally:
+                lock.release()
+        
+        future.add_done_callback(on_written)
+        await asyncio.shield(future)
         return save_path
     
+    def _record_save(self, save_path: str, digest: Optional[bytes]):
+        """记录一次完成的写入，digest为None表示内容未变化、未写盘"""
+        if digest is not None:
+            self._last_save_hashes[save_path] = digest
+            self._saves_cache = None
+    
+    def _on_save_done(self, task: asyncio.Task):
+        """后台保存完成回调"""
+        self._pending_saves.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"后台保存失败: {task.exception()}")
+    
+    def _build_save_data(self) -> Dict[str, Any]:
+        """生成存档数据快照"""
+        # 不复用提示词上下文缓存：对象可能被直接修改而未标记变化，存档必须反映最新状态
+        return {
+            "character": self.character.to_dict(),
+            "game_state": self.game_state.to_dict(),
+            "inventory": [item.to_dict() for item in self.inventory],
+            "conversation_history": list(self.conversation_history)
+        }
+    
     def load_game(self, save_name: str = "autosave") -> bool:
         """
         加载游戏
@@ -415,14 +735,19 @@ class GameSession:
         
         try:
             # 读取存档
-            with open(save_path, "r", encoding="utf-8") as f:
-                save_data = json.load(f)
+            with open(save_path, "rb") as f:
+                save_data = json_loads(f.read())
             
             # 恢复游戏状态
-            self.character = Character.from_dict(save_data["character"])
-            self.game_state = GameState.from_dict(save_data["game_state"])
-            self.inventory = [Item.from_dict(item) for item in save_data["inventory"]]
+            self.character = Character.fast_from_dict(save_data["character"])
+            self.game_state = GameState.fast_from_dict(save_data["game_state"])
+            self.inventory = [Item.fast_from_dict(item) for item in save_data["inventory"]]
+            self._inventory_by_id = {item.id: item for item in self.inventory}
             self.conversation_history = save_data["conversation_history"]
+            self.prompt_manager.clear_history()
+            for message in self.conversation_history[-5:]:
+                self.prompt_manager.append_history(message["role"], message["content"])
+            self.invalidate_prompt_cache()
             
             logger.info(f"游戏已加载: {save_path}")
             return True
@@ -438,11 +763,20 @@ class GameSession:
         Returns:
             存档名称列表
         """
-        if not os.path.exists(self.save_directory):
+        try:
+            mtime_ns = os.stat(self.save_directory).st_mtime_ns
+        except FileNotFoundError:
             return []
+        
+        # 目录未变化时直接复用上次的扫描结果
+        cache = self._saves_cache
+        if cache is not None and cache[0] == mtime_ns:
+            return list(cache[1])
             
-        save_files = [f for f in os.listdir(self.save_directory) if f.endswith(".json")]
-        return [os.path.splitext(f)[0] for f in save_files]
+        with os.scandir(self.save_directory) as it:
+            saves = [e.name[:-5] for e in it if e.name.endswith(".json") and e.is_file()]
+        self._saves_cache = (mtime_ns, saves)
+        return list(saves)
 
 
 # 示例用法
@@ -493,7 +827,9 @@ async def example_usage():
     user_input = "我环顾四周，看看这个森林入口有什么特别之处"
     print(f"你: {user_input}")
     
-    result = await session.process_input(user_input)
+    async with session:
+        result = await session.process_input(user_input)
+    await shutdown_clients()
     
     # 保存游戏
     session.save_game("demo_save")
@@ -506,4 +842,6 @@ async def example_usage():
 
 
 if __name__ == "__main__":
+    configure_logging()
+    install_event_loop_policy()
     asyncio.run(example_usage()) 
\ No newline at end of file
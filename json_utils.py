@@ -0,0 +1,40 @@
+"""
+JSON工具模块：统一封装可选的orjson加速，未安装时使用标准库json
+"""
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，未安装时使用标准库json
+    orjson = None
+
+# orjson.JSONDecodeError是json.JSONDecodeError的子类，两种实现都可以用它捕获解析错误
+JSONDecodeError = json.JSONDecodeError
+
+
+def json_dumps(obj: Any) -> bytes:
+    """将对象序列化为紧凑的UTF-8编码JSON字节串"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson不支持的类型交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def json_dumps_pretty(obj: Any) -> bytes:
+    """将对象序列化为带2空格缩进的UTF-8 JSON，与json.dumps(ensure_ascii=False, indent=2)输出一致"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # orjson不支持的类型交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+# 解析JSON字节串或字符串；直接绑定底层函数，热循环中不多一层调用
+json_loads = orjson.loads if orjson is not None else json.loads
@@ -5,16 +5,33 @@
 import os
 import sys
 import asyncio
+import logging
 import argparse
 from typing import Dict, List, Any, Optional
 
-from ai_core import AICore, create_messages
+from ai_core import AICore, create_messages, shutdown_clients, install_event_loop_policy
 from prompt_manager import PromptManager
 from stream_processor import StreamProcessor
 from output_formatter import OutputFormatter
-from game_integration import GameSession, Character, GameState, Item
+from game_integration import GameSession, Character, GameState, Item, configure_logging
 from config import API_CONFIG
 
+logger = logging.getLogger("main")
+
+# 特殊命令 -> 处理方法名，在初始化时绑定为方法对象
+_COMMANDS = {
+    "help": "_show_help",
+    "save": "_handle_save",
+    "load": "_handle_load",
+    "inventory": "_show_inventory",
+    "i": "_show_inventory",
+    "status": "_show_status",
+    "s": "_show_status"
+}
+
+_LOOK_COMMANDS = frozenset(("look", "l"))
+_LOOK_INPUT = "我环顾四周，看看这里有什么。"
+
 class TextAdventureGame:
     """文本冒险游戏主程序"""
     
@@ -26,6 +43,13 @@ class TextAdventureGame:
             api_key: API密钥，如果不提供则尝试从环境变量读取
             ai_provider: AI服务提供商，默认使用配置文件中的设置
         """
+        configure_logging()
+        
+        self._command_handlers = {
+            command: getattr(self, method_name)
+            for command, method_name in _COMMANDS.items()
+        }
+        
         self.ai_provider = ai_provider or API_CONFIG["default_provider"]
         self.api_key = api_key
         
@@ -87,13 +111,14 @@ class TextAdventureGame:
         name = input("\n请输入你的角色名称（默认：冒险者）: ").strip()
         if name:
             self.session.character.name = name
+            self.session.invalidate_prompt_cache()
         
         print(f"\n你好，{self.session.character.name}！你的冒险即将开始。")
         print("\n输入 'help' 可查看帮助信息，输入 'quit' 可退出游戏。")
         print("\n" + "-"*50)
         
         # 开始游戏
-        await self.process_input("我环顾四周，看看这里有什么。")
+        await self.process_input(_LOOK_INPUT)
         
         # 进入主循环
         await self.game_loop()
@@ -117,23 +142,21 @@ class TextAdventureGame:
             for i, save in enumerate(saves, 1):
                 print(f"{i}. {save}")
                 
-            choice = input("\n请选择要加载的存档（输入编号）或输入 'n' 开始新游戏: ")
+            choice = input("\n请选择要加载的存档（输入编号）或输入 'n' 开始新游戏: ").strip()
             if choice.lower() == 'n':
                 await self.start_new_game()
                 return
                 
-            try:
-                save_index = int(choice) - 1
-                if 0 <= save_index < len(saves):
-                    save_name = saves[save_index]
-                else:
-                    print("\n无效的选择，将开始新游戏。")
-                    await self.start_new_game()
-                    return
-            except ValueError:
+            if not choice.isdecimal():
                 print("\n无效的输入，将开始新游戏。")
                 await self.start_new_game()
                 return
+            save_index = int(choice) - 1
+            if not 0 <= save_index < len(saves):
+                print("\n无效的选择，将开始新游戏。")
+                await self.start_new_game()
+                return
+            save_name = saves[save_index]
         
         # 加载存档
         if self.session.load_game(save_name):
@@ -165,26 +188,20 @@ class TextAdventureGame:
             user_input = input("\n> ").strip()
             
             # 检查特殊命令
-            if user_input.lower() == 'quit':
-                self._handle_quit()
+            command = user_input.lower()
+            if command == 'quit':
+                await self._handle_quit()
                 break
-            elif user_input.lower() == 'help':
-                self._show_help()
-                continue
-            elif user_input.lower() == 'save':
-                self._handle_save()
-                continue
-            elif user_input.lower() == 'load':
-                await self._handle_load()
-                continue
-            elif user_input.lower() == 'inventory' or user_input.lower() == 'i':
-                self._show_inventory()
-                continue
-            elif user_input.lower() == 'status' or user_input.lower() == 's':
-                self._show_status()
+            
+            handler = self._command_handlers.get(command)
+            if handler is not None:
+                result = handler()
+                if asyncio.iscoroutine(result):
+                    await result
                 continue
-            elif user_input.lower() == 'look' or user_input.lower() == 'l':
-                user_input = "我环顾四周，看看这里有什么。"
+            
+            if command in _LOOK_COMMANDS:
+                user_input = _LOOK_INPUT
             
             # 处理用户输入
             await self.process_input(user_input)
@@ -216,13 +233,13 @@ class TextAdventureGame:
         except Exception as e:
             print(f"\n发生错误: {str(e)}")
     
-    def _handle_save(self):
+    async def _handle_save(self):
         """处理保存游戏"""
         save_name = input("\n请输入存档名称（默认：autosave）: ").strip()
         if not save_name:
             save_name = "autosave"
             
-        save_path = self.session.save_game(save_name)
+        save_path = await self.session.save_game_async(save_name)
         print(f"\n游戏已保存至: {save_path}")
     
     async def _handle_load(self):
@@ -236,32 +253,33 @@ class TextAdventureGame:
         for i, save in enumerate(saves, 1):
             print(f"{i}. {save}")
             
-        choice = input("\n请选择要加载的存档（输入编号）或按Enter取消: ")
+        choice = input("\n请选择要加载的存档（输入编号）或按Enter取消: ").strip()
         if not choice:
             return
             
-        try:
-            save_index = int(choice) - 1
-            if 0 <= save_index < len(saves):
-                save_name = saves[save_index]
-                if self.session.load_game(save_name):
-                    print(f"\n成功加载存档: {save_name}")
-                    print(f"\n你是{self.session.character.name}，当前位置：{self.session.game_state.location}")
-                    
-                    # 生成当前位置的描述
-                    await self.process_input("我环顾四周，看看这里有什么。")
-                else:
-                    print(f"\n无法加载存档: {save_name}")
-            else:
-                print("\n无效的选择。")
-        except ValueError:
+        if not choice.isdecimal():
             print("\n无效的输入。")
+            return
+        save_index = int(choice) - 1
+        if not 0 <= save_index < len(saves):
+            print("\n无效的选择。")
+            return
+        
+        save_name = saves[save_index]
+        if self.session.load_game(save_name):
+            print(f"\n成功加载存档: {save_name}")
+            print(f"\n你是{self.session.character.name}，当前位置：{self.session.game_state.location}")
+            
+            # 生成当前位置的描述
+            await self.process_input(_LOOK_INPUT)
+        else:
+            print(f"\n无法加载存档: {save_name}")
     
-    def _handle_quit(self):
+    async def _handle_quit(self):
         """处理退出游戏"""
         save = input("\n是否保存游戏？(y/n): ").strip().lower()
         if save == 'y':
-            self._handle_save()
+            await self._handle_save()
             
         print("\n感谢游玩！再见！")
     
@@ -346,39 +364,35 @@ async def main():
     game = TextAdventureGame(api_key=args.api_key, ai_provider=args.provider)
     
     try:
-        # 加载存档或开始新游戏
-        if args.load:
-            await game.load_game(args.load)
-        else:
-            # 检查是否有存档
-            saves = game.session.list_saves()
-            if saves:
-                print("\n发现现有存档，是否加载？")
-                for i, save in enumerate(saves, 1):
-                    print(f"{i}. {save}")
-                print("n. 开始新游戏")
+        async with game.session:
+            # 加载存档或开始新游戏
+            if args.load:
+                await game.load_game(args.load)
+            else:
+                # 检查是否有存档
+                saves = game.session.list_saves()
+                if saves:
+                    print("\n发现现有存档，是否加载？")
+                    for i, save in enumerate(saves, 1):
+                        print(f"{i}. {save}")
+                    print("n. 开始新游戏")
                 
-                choice = input("\n请选择: ").strip().lower()
-                if choice == 'n':
-                    await game.start_new_game()
-                else:
-                    try:
-                        save_index = int(choice) - 1
-                        if 0 <= save_index < len(saves):
-                            await game.load_game(saves[save_index])
-                        else:
-                            await game.start_new_game()
-                    except ValueError:
+                    choice = input("\n请选择: ").strip().lower()
+                    if choice.isdecimal() and 0 < int(choice) <= len(saves):
+                        await game.load_game(saves[int(choice) - 1])
+                    else:
                         await game.start_new_game()
-            else:
-                await game.start_new_game()
+                else:
+                    await game.start_new_game()
     except KeyboardInterrupt:
         print("\n\n游戏已中断。再见！")
     except Exception as e:
         print(f"\n发生错误: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("主循环中发生未处理的错误")
+    finally:
+        await shutdown_clients()
 
 
 if __name__ == "__main__":
+    install_event_loop_policy()
     asyncio.run(main()) 
\ No newline at end of file
@@ -2,11 +2,136 @@
 输出格式化模块：负责格式解析和内容分段处理
 """
 
+import io
 import re
 import json
+from string import Formatter
 from typing import Dict, List, Any, Optional, Union, Tuple, Callable
 from config import PROMPT_CONFIG
 
+_FORMATTER = Formatter()
+
+# 正则源码中具有特殊含义的字符
+_REGEX_SPECIAL = frozenset(".^$*+?{}[]\\|()")
+
+# 内容类型 -> format_game_output结果中的列表键（option单独处理）
+_GAME_OUTPUT_KEYS = {
+    "narrative": "narrative",
+    "action": "actions",
+    "system": "system",
+    "error": "errors"
+}
+
+# 内容类型 -> HTML模板
+_HTML_TEMPLATES = {
+    "narrative": '<div class="narrative">{content}</div>',
+    "action": '<div class="action">{content}</div>',
+    "option": '<button class="option" data-id="{id}">{content}</button>',
+    "system": '<div class="system-message">{content}</div>',
+    "error": '<div class="error-message">{content}</div>'
+}
+
+# 内容类型 -> 纯文本模板
+_TEXT_TEMPLATES = {
+    "narrative": "{content}",
+    "action": "* {content}",
+    "option": "[{id}] {content}",
+    "system": "系统: {content}",
+    "error": "错误: {content}"
+}
+
+
+def compile_tag_builder(tag: str) -> Callable[..., str]:
+    """
+    将标签模板预编译为构造函数，避免每次调用都重新解析格式字符串
+    
+    只含简单命名参数的模板（如<OPTION id="{id}">）转换为%格式化模板，
+    含格式说明或位置参数的模板退回str.format
+    
+    Args:
+        tag: 标签模板
+        
+    Returns:
+        接收关键字参数并返回标签字符串的函数
+    """
+    if "{" not in tag:
+        return lambda **kwargs: tag
+        
+    pieces = []
+    for literal, field_name, format_spec, conversion in _FORMATTER.parse(tag):
+        pieces.append(literal.replace("%", "%%"))
+        if field_name is None:
+            continue
+        if format_spec or conversion or not field_name.isidentifier():
+            return tag.format
+        pieces.append(f"%({field_name})s")
+        
+    template = "".join(pieces)
+    return lambda **kwargs: template % kwargs
+
+
+def compile_tag_union(patterns: List[str], flags: int = 0) -> Tuple["re.Pattern", List[int]]:
+    """
+    将多个标签正则合并为一个按字面前缀分叉的交替模式（前缀树）
+    
+    各模式开头的字面字符按前缀树合并，例如<NARRATIVE>与</NARRATIVE>共享'<'，
+    正则引擎可以用字面前缀快速跳过普通文本，并在每个字符处只沿一个分支继续，
+    而不是逐一尝试所有标签。每个模式包在一个命名外层分组中，其内部分组紧随其后编号
+    
+    合并后各模式的尝试顺序必须与原列表一致才能保持匹配优先级。若前缀树会打乱
+    顺序（例如['<AX', '<[AB]', '<AY']中第3个模式会先于第2个被尝试），则退回
+    不做前缀合并的普通交替
+    
+    Args:
+        patterns: 标签正则源码列表
+        flags: 正则编译标志
+        
+    Returns:
+        (编译后的正则, 每个模式对应的外层分组编号列表)
+    """
+    # 前缀树节点：字符 -> 子节点；None -> [(模式序号, 剩余正则源码)]
+    root: Dict[Any, Any] = {}
+    for index, pattern in enumerate(patterns):
+        prefix_length = _literal_prefix_length(pattern)
+        node = root
+        for char in pattern[:prefix_length]:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append((index, pattern[prefix_length:]))
+    
+    def emit(node: Dict[Any, Any]) -> Tuple[List[int], str]:
+        # 返回(该子树中模式的尝试顺序, 正则源码)；分支按其中最小的模式序号排列
+        branches = []
+        for key, value in node.items():
+            if key is None:
+                for index, suffix in value:
+                    branches.append(([index], f"(?P<_t{index}>{suffix})"))
+            else:
+                order, source = emit(value)
+                branches.append((order, re.escape(key) + source))
+        branches.sort(key=lambda branch: branch[0][0])
+        if len(branches) == 1:
+            return branches[0]
+        order = [index for branch_order, _ in branches for index in branch_order]
+        return order, "(?:" + "|".join(source for _, source in branches) + ")"
+    
+    order, source = emit(root)
+    if order != list(range(len(patterns))):
+        source = "|".join(f"(?P<_t{index}>{pattern})" for index, pattern in enumerate(patterns))
+    
+    compiled = re.compile(source, flags)
+    return compiled, [compiled.groupindex[f"_t{index}"] for index in range(len(patterns))]
+
+
+def _literal_prefix_length(pattern: str) -> int:
+    """返回正则源码开头纯字面字符的长度（不含被量词修饰的末字符）"""
+    length = 0
+    while length < len(pattern) and pattern[length] not in _REGEX_SPECIAL:
+        length += 1
+    if 0 < length < len(pattern) and pattern[length] in "*+?{":
+        length -= 1
+    return length
+
+
 class OutputFormatter:
     """输出格式化器，负责解析和处理AI输出的格式化内容"""
     
@@ -24,6 +149,11 @@ class OutputFormatter:
         """编译用于匹配各种输出格式的正则表达式模式"""
         self.patterns = {}
         
+        # 所有格式合并成的单个正则，parse_content只需扫描一遍内容
+        union_parts = []
+        # (格式类型, 是否带id参数)，与union_parts一一对应
+        union_formats = []
+        
         for format_type, format_info in self.output_formats.items():
             start_tag = format_info["start_tag"]
             end_tag = format_info["end_tag"]
@@ -35,10 +165,34 @@ class OutputFormatter:
                 pattern_str = re.escape(start_tag).replace("\\{id\\}", '([^"]+)')
                 pattern_str += "(.*?)" + re.escape(end_tag)
                 self.patterns[format_type] = re.compile(pattern_str, re.DOTALL)
+                union_formats.append((format_type, True))
             else:
                 # 对于没有参数的标签，使用简单的模式
                 pattern_str = re.escape(start_tag) + "(.*?)" + re.escape(end_tag)
                 self.patterns[format_type] = re.compile(pattern_str, re.DOTALL)
+                union_formats.append((format_type, False))
+            
+            union_parts.append(pattern_str)
+        
+        self.union_pattern, outer_groups = compile_tag_union(union_parts, re.DOTALL)
+        
+        # 外层分组编号 -> (格式类型, id分组编号, 内容分组编号)
+        self._union_groups = {}
+        for group, (format_type, has_id) in zip(outer_groups, union_formats):
+            if has_id:
+                self._union_groups[group] = (format_type, group + 1, group + 2)
+            else:
+                self._union_groups[group] = (format_type, None, group + 1)
+        
+        # 预编译标签构造函数，format_content无需每次解析模板
+        self._start_builders = {
+            format_type: compile_tag_builder(format_info["start_tag"])
+            for format_type, format_info in self.output_formats.items()
+        }
+        self._end_tags = {
+            format_type: format_info["end_tag"]
+            for format_type, format_info in self.output_formats.items()
+        }
     
     def parse_content(self, content: str) -> List[Dict[str, Any]]:
         """
@@ -51,30 +205,26 @@ class OutputFormatter:
             解析后的内容段列表，每个元素包含类型和内容
         """
         parsed_segments = []
+        union_groups = self._union_groups
         
-        # 遍历所有格式类型，查找匹配
-        for format_type, pattern in self.patterns.items():
-            for match in pattern.finditer(content):
-                if "{" in self.output_formats[format_type]["start_tag"]:
-                    # 带参数的标签（如OPTION）
-                    id_value = match.group(1)
-                    content_text = match.group(2)
-                    parsed_segments.append({
-                        "type": format_type,
-                        "content": content_text,
-                        "id": id_value
-                    })
-                else:
-                    # 无参数标签（如NARRATIVE）
-                    content_text = match.group(1)
-                    parsed_segments.append({
-                        "type": format_type,
-                        "content": content_text
-                    })
-        
-        # 按照在原始文本中的顺序排序解析结果
-        parsed_segments.sort(key=lambda x: content.find(x["content"]))
+        # 单次扫描，根据匹配到的外层分组确定格式类型
+        for match in self.union_pattern.finditer(content):
+            format_type, id_group, content_group = union_groups[match.lastindex]
+            if id_group is not None:
+                # 带参数的标签（如OPTION）
+                parsed_segments.append({
+                    "type": format_type,
+                    "content": match.group(content_group),
+                    "id": match.group(id_group)
+                })
+            else:
+                # 无参数标签（如NARRATIVE）
+                parsed_segments.append({
+                    "type": format_type,
+                    "content": match.group(content_group)
+                })
         
+        # finditer按出现位置依次返回匹配，结果已是原始文本中的顺序，无需再排序
         return parsed_segments
     
     def extract_by_type(self, content: str, format_type: str) -> List[Dict[str, Any]]:
@@ -129,18 +279,11 @@ class OutputFormatter:
         Raises:
             ValueError: 如果格式类型不存在
         """
-        if format_type not in self.output_formats:
+        build_start = self._start_builders.get(format_type)
+        if build_start is None:
             raise ValueError(f"未知的格式类型: {format_type}")
             
-        format_info = self.output_formats[format_type]
-        start_tag = format_info["start_tag"]
-        end_tag = format_info["end_tag"]
-        
-        # 处理包含参数的标签
-        if "{" in start_tag:
-            start_tag = start_tag.format(**kwargs)
-            
-        return f"{start_tag}{content}{end_tag}"
+        return f"{build_start(**kwargs)}{content}{self._end_tags[format_type]}"
     
     def format_game_output(self, parsed_content: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -163,19 +306,16 @@ class OutputFormatter:
         for segment in parsed_content:
             content_type = segment["type"]
             
-            if content_type == "narrative":
-                result["narrative"].append(segment["content"])
-            elif content_type == "action":
-                result["actions"].append(segment["content"])
-            elif content_type == "option":
+            if content_type == "option":
                 result["options"].append({
                     "id": segment.get("id", "unknown"),
                     "text": segment["content"]
                 })
-            elif content_type == "system":
-                result["system"].append(segment["content"])
-            elif content_type == "error":
-                result["errors"].append(segment["content"])
+                continue
+                
+            key = _GAME_OUTPUT_KEYS.get(content_type)
+            if key is not None:
+                result[key].append(segment["content"])
                 
         return result
     
@@ -189,25 +329,19 @@ class OutputFormatter:
         Returns:
             HTML格式的内容
         """
-        html_parts = []
+        # 直接写入同一个缓冲区，不保留中间字符串列表
+        buffer = io.StringIO()
+        write = buffer.write
+        separator = ""
         
         for segment in parsed_content:
-            content_type = segment["type"]
-            content = segment["content"]
-            
-            if content_type == "narrative":
-                html_parts.append(f'<div class="narrative">{content}</div>')
-            elif content_type == "action":
-                html_parts.append(f'<div class="action">{content}</div>')
-            elif content_type == "option":
-                option_id = segment.get("id", "unknown")
-                html_parts.append(f'<button class="option" data-id="{option_id}">{content}</button>')
-            elif content_type == "system":
-                html_parts.append(f'<div class="system-message">{content}</div>')
-            elif content_type == "error":
-                html_parts.append(f'<div class="error-message">{content}</div>')
+            template = _HTML_TEMPLATES.get(segment["type"])
+            if template is not None:
+                write(separator)
+                write(template.format(content=segment["content"], id=segment.get("id", "unknown")))
+                separator = "\n"
                 
-        return "\n".join(html_parts)
+        return buffer.getvalue()
     
     def format_to_text(self, parsed_content: List[Dict[str, Any]]) -> str:
         """
@@ -219,25 +353,19 @@ class OutputFormatter:
         Returns:
             文本格式的内容
         """
-        text_parts = []
+        # 直接写入同一个缓冲区，不保留中间字符串列表
+        buffer = io.StringIO()
+        write = buffer.write
+        separator = ""
         
         for segment in parsed_content:
-            content_type = segment["type"]
-            content = segment["content"]
-            
-            if content_type == "narrative":
-                text_parts.append(f"{content}")
-            elif content_type == "action":
-                text_parts.append(f"* {content}")
-            elif content_type == "option":
-                option_id = segment.get("id", "unknown")
-                text_parts.append(f"[{option_id}] {content}")
-            elif content_type == "system":
-                text_parts.append(f"系统: {content}")
-            elif content_type == "error":
-                text_parts.append(f"错误: {content}")
+            template = _TEXT_TEMPLATES.get(segment["type"])
+            if template is not None:
+                write(separator)
+                write(template.format(content=segment["content"], id=segment.get("id", "unknown")))
+                separator = "\n\n"
                 
-        return "\n\n".join(text_parts)
+        return buffer.getvalue()
 
 
 # 示例用法
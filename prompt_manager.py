@@ -3,10 +3,15 @@
 """
 
 import os
-import json
+from collections import deque
 from typing import Dict, List, Any, Optional, Union
 from string import Template
-from config import PROMPT_CONFIG
+from config import PROMPT_CONFIG, SYSTEM_PROMPT_CANONICAL
+from output_formatter import compile_tag_builder
+from json_utils import json_dumps_pretty
+
+# 模板文件扩展名
+_TEMPLATE_SUFFIXES = (".txt", ".prompt")
 
 class PromptTemplate:
     """提示词模板类，用于管理和渲染提示词模板"""
@@ -19,10 +24,41 @@ class PromptTemplate:
             template: 提示词模板字符串，可包含$name格式的占位符
         """
         self.template = Template(template)
+        self._compile(template)
+    
+    def _compile(self, template: str):
+        """
+        预先解析模板，拆分为(前置文本, 占位符名, 占位符原文)片段，渲染时不再运行正则
+        
+        Args:
+            template: 提示词模板字符串
+        """
+        segments = []
+        literal = []
+        pos = 0
+        
+        for match in Template.pattern.finditer(template):
+            literal.append(template[pos:match.start()])
+            pos = match.end()
+            
+            name = match.group("named") or match.group("braced")
+            if name is not None:
+                segments.append(("".join(literal), name, match.group()))
+                literal = []
+            elif match.group("escaped") is not None:
+                # $$ 转义为单个 $
+                literal.append(Template.delimiter)
+            else:
+                # 无效占位符原样保留，与safe_substitute一致
+                literal.append(match.group())
+        
+        literal.append(template[pos:])
+        self._segments = segments
+        self._tail = "".join(literal)
     
     def render(self, **kwargs) -> str:
         """
-        渲染提示词模板
+        渲染提示词模板，语义与safe_substitute相同：缺失的占位符原样保留
         
         Args:
             **kwargs: 用于替换模板中占位符的键值对
@@ -30,27 +66,41 @@ class PromptTemplate:
         Returns:
             渲染后的提示词字符串
         """
-        return self.template.safe_substitute(**kwargs)
+        if not self._segments:
+            return self._tail
+            
+        parts = []
+        for literal, name, placeholder in self._segments:
+            parts.append(literal)
+            parts.append(str(kwargs[name]) if name in kwargs else placeholder)
+        parts.append(self._tail)
+        return "".join(parts)
 
 
 class PromptManager:
     """提示词管理器，用于管理和生成提示词"""
     
-    def __init__(self, system_prompt: str = None, templates_dir: str = None):
+    def __init__(self, system_prompt: str = None, templates_dir: str = None, history_tail_size: int = 5):
         """
         初始化提示词管理器
         
         Args:
-            system_prompt: 系统提示词，默认使用配置文件中的系统提示词
+            system_prompt: 系统提示词，默认使用配置文件中规范化后的系统提示词
             templates_dir: 提示词模板目录，默认为"./prompts"
+            history_tail_size: 游戏提示词中"最近对话"保留的消息条数
         """
-        self.system_prompt = system_prompt or PROMPT_CONFIG["system_prompt"]
+        self.system_prompt = system_prompt or SYSTEM_PROMPT_CANONICAL
         self.templates_dir = templates_dir or "./prompts"
         self.templates: Dict[str, PromptTemplate] = {}
+        # 已读取但尚未编译的模板源码，首次get_template时才创建PromptTemplate
+        self._template_sources: Dict[str, str] = {}
         self.context: Dict[str, Any] = {}
+        # 预先格式化好的最近对话，由append_history维护
+        self._history_tail: deque = deque(maxlen=history_tail_size)
         
         # 加载内置的输出格式模板
         self.output_formats = PROMPT_CONFIG["output_format"]
+        self._compile_formatters()
         
         # 确保模板目录存在
         if not os.path.exists(self.templates_dir):
@@ -59,20 +109,55 @@ class PromptManager:
         # 加载模板目录中的所有模板
         self._load_templates()
     
+    @property
+    def system_prompt(self) -> str:
+        """系统提示词"""
+        return self._system_prompt
+    
+    @system_prompt.setter
+    def system_prompt(self, value: str):
+        """设置系统提示词，含$占位符时预先编译为模板"""
+        self._system_prompt = value
+        self._system_template = PromptTemplate(value) if "$" in value else None
+    
+    def _compile_formatters(self):
+        """预编译各输出格式的标签构造函数"""
+        self._start_builders = {
+            format_type: compile_tag_builder(format_info["start_tag"])
+            for format_type, format_info in self.output_formats.items()
+        }
+        self._end_tags = {
+            format_type: format_info["end_tag"]
+            for format_type, format_info in self.output_formats.items()
+        }
+        
+        # 游戏提示词末尾的输出格式说明不随回合变化，只生成一次
+        self._format_help_block = "\n\n".join(
+            ["请使用以下格式回应:"] + [
+                f"- {format_info['description']}: {format_info['start_tag']}内容{format_info['end_tag']}"
+                for format_info in self.output_formats.values()
+            ]
+        )
+    
     def _load_templates(self):
-        """加载模板目录中的所有模板文件"""
+        """读取模板目录中的所有模板文件，编译推迟到首次使用"""
         if not os.path.exists(self.templates_dir):
             return
             
-        for filename in os.listdir(self.templates_dir):
-            if filename.endswith(".txt") or filename.endswith(".prompt"):
-                template_name = os.path.splitext(filename)[0]
-                file_path = os.path.join(self.templates_dir, filename)
+        with os.scandir(self.templates_dir) as entries:
+            for entry in entries:
+                # 先用文件名过滤，目录项自带文件类型，通常无需额外stat
+                if not entry.name.endswith(_TEMPLATE_SUFFIXES) or not entry.is_file():
+                    continue
+                template_name = os.path.splitext(entry.name)[0]
                 
-                with open(file_path, "r", encoding="utf-8") as f:
-                    template_content = f.read()
+                # 二进制整块读取后解码，绕过文本模式的逐行换行处理
+                with open(entry.path, "rb") as f:
+                    template_content = f.read().decode("utf-8")
+                if "\r" in template_content:
+                    template_content = template_content.replace("\r\n", "\n").replace("\r", "\n")
                     
-                self.templates[template_name] = PromptTemplate(template_content)
+                self._template_sources[template_name] = template_content
     
     def save_template(self, name: str, template: str):
         """
@@ -84,6 +169,7 @@ class PromptManager:
         """
         # 创建模板对象
         self.templates[name] = PromptTemplate(template)
+        self._template_sources.pop(name, None)
         
         # 保存到文件
         file_path = os.path.join(self.templates_dir, f"{name}.prompt")
@@ -100,7 +186,13 @@ class PromptManager:
         Returns:
             提示词模板对象，如果不存在则返回None
         """
-        return self.templates.get(name)
+        template = self.templates.get(name)
+        if template is None:
+            source = self._template_sources.pop(name, None)
+            if source is None:
+                return None
+            template = self.templates[name] = PromptTemplate(source)
+        return template
     
     def render_template(self, name: str, **kwargs) -> str:
         """
@@ -138,6 +230,20 @@ class PromptManager:
         """清空提示词上下文"""
         self.context.clear()
     
+    def append_history(self, role: str, content: str):
+        """
+        记录一条对话，供create_game_prompt的"最近对话"部分使用
+        
+        Args:
+            role: 角色（user或assistant）
+            content: 消息内容
+        """
+        self._history_tail.append(f"{role}: {content}")
+    
+    def clear_history(self):
+        """清空记录的最近对话"""
+        self._history_tail.clear()
+    
     def get_system_prompt(self) -> str:
         """
         获取系统提示词，可根据上下文动态生成
@@ -145,12 +251,11 @@ class PromptManager:
         Returns:
             系统提示词字符串
         """
-        # 如果系统提示词是模板，则进行渲染
-        if "$" in self.system_prompt:
-            template = PromptTemplate(self.system_prompt)
-            return template.render(**self.context)
+        # 如果系统提示词是模板，则用预先编译的模板进行渲染
+        if self._system_template is not None:
+            return self._system_template.render(**self.context)
             
-        return self.system_prompt
+        return self._system_prompt
     
     def format_output(self, content: str, format_type: str, **kwargs) -> str:
         """
@@ -167,18 +272,11 @@ class PromptManager:
         Raises:
             ValueError: 如果格式类型不存在
         """
-        if format_type not in self.output_formats:
+        build_start = self._start_builders.get(format_type)
+        if build_start is None:
             raise ValueError(f"未定义的输出格式类型: {format_type}")
             
-        format_template = self.output_formats[format_type]
-        start_tag = format_template["start_tag"]
-        end_tag = format_template["end_tag"]
-        
-        # 处理包含参数的标签（如OPTION的id）
-        if "{" in start_tag:
-            start_tag = start_tag.format(**kwargs)
-            
-        return f"{start_tag}{content}{end_tag}"
+        return f"{build_start(**kwargs)}{content}{self._end_tags[format_type]}"
     
     def create_game_prompt(
         self, 
@@ -196,7 +294,38 @@ class PromptManager:
             game_state: 游戏状态信息
             inventory: 物品栏信息
             character: 角色信息
-            conversation_history: 对话历史
+            conversation_history: 对话历史，不提供时使用append_history记录的最近对话
+            
+        Returns:
+            完整的游戏提示词
+        """
+        return self.assemble_game_prompt(
+            user_input,
+            state_info=json_dumps_pretty(game_state).decode("utf-8") if game_state else None,
+            inventory_info=json_dumps_pretty(inventory).decode("utf-8") if inventory else None,
+            character_info=json_dumps_pretty(character).decode("utf-8") if character else None,
+            conversation_history=conversation_history
+        )
+    
+    def assemble_game_prompt(
+        self,
+        user_input: str,
+        state_info: str = None,
+        inventory_info: str = None,
+        character_info: str = None,
+        conversation_history: List[Dict[str, str]] = None
+    ) -> str:
+        """
+        用已序列化好的各部分JSON文本组装游戏提示词
+        
+        调用方可以自行缓存未变化部分的JSON文本，避免每轮重新序列化
+        
+        Args:
+            user_input: 用户输入
+            state_info: 游戏状态JSON文本
+            inventory_info: 物品栏JSON文本
+            character_info: 角色信息JSON文本
+            conversation_history: 对话历史，不提供时使用append_history记录的最近对话
             
         Returns:
             完整的游戏提示词
@@ -204,19 +333,16 @@ class PromptManager:
         prompt_parts = []
         
         # 添加游戏状态信息
-        if game_state:
-            state_info = json.dumps(game_state, ensure_ascii=False, indent=2)
+        if state_info:
             prompt_parts.append(f"当前游戏状态:\n{state_info}")
             
         # 添加角色信息
-        if character:
-            char_info = json.dumps(character, ensure_ascii=False, indent=2)
-            prompt_parts.append(f"角色信息:\n{char_info}")
+        if character_info:
+            prompt_parts.append(f"角色信息:\n{character_info}")
             
         # 添加物品栏信息
-        if inventory:
-            inv_info = json.dumps(inventory, ensure_ascii=False, indent=2)
-            prompt_parts.append(f"物品栏:\n{inv_info}")
+        if inventory_info:
+            prompt_parts.append(f"物品栏:\n{inventory_info}")
             
         # 添加对话历史摘要（如果提供）
         if conversation_history:
@@ -224,14 +350,14 @@ class PromptManager:
             recent_history = conversation_history[-5:] if len(conversation_history) > 5 else conversation_history
             history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_history])
             prompt_parts.append(f"最近对话:\n{history_text}")
+        elif self._history_tail:
+            prompt_parts.append("最近对话:\n" + "\n".join(self._history_tail))
             
         # 添加用户当前输入
         prompt_parts.append(f"用户输入: {user_input}")
         
         # 添加输出格式说明
-        prompt_parts.append("请使用以下格式回应:")
-        for format_type, format_info in self.output_formats.items():
-            prompt_parts.append(f"- {format_info['description']}: {format_info['start_tag']}内容{format_info['end_tag']}")
+        prompt_parts.append(self._format_help_block)
             
         # 组合所有部分
         return "\n\n".join(prompt_parts)
@@ -6,6 +6,10 @@ import re
 import asyncio
 from typing import Dict, List, Any, Optional, Callable, AsyncGenerator, Union, Set
 from config import STREAM_CONFIG, PROMPT_CONFIG
+from output_formatter import compile_tag_union
+
+# process_stream每处理多少个文本块主动让出一次事件循环
+_YIELD_EVERY = 32
 
 class StreamBuffer:
     """流内容缓冲区，用于处理流式传输的文本块"""
@@ -18,7 +22,9 @@ class StreamBuffer:
             buffer_size: 缓冲区大小，默认从配置中获取
         """
         self.buffer_size = buffer_size or STREAM_CONFIG.get("buffer_size", 1024)
-        self.buffer = ""
+        # 文本块列表，避免逐块拼接字符串造成的二次方复制
+        self._chunks: List[str] = []
+        self._length = 0
         self.processed_content = ""
     
     def add_chunk(self, chunk: str) -> str:
@@ -32,27 +38,47 @@ class StreamBuffer:
             处理后可以输出的文本
         """
         # 添加新块到缓冲区
-        self.buffer += chunk
+        self._chunks.append(chunk)
+        self._length += len(chunk)
         
-        # 确保缓冲区不超过最大大小
-        if len(self.buffer) > self.buffer_size:
-            # 保留后半部分以避免截断标签
-            self.buffer = self.buffer[-self.buffer_size:]
+        # 累积超过两倍容量时才合并截断，均摊后每个字符只复制常数次
+        if self._length > self.buffer_size * 2:
+            self._compact()
         
         return chunk
     
+    def _compact(self):
+        """合并文本块并只保留最后buffer_size个字符"""
+        buffer = "".join(self._chunks)[-self.buffer_size:]
+        self._chunks = [buffer]
+        self._length = len(buffer)
+    
     def get_buffer(self) -> str:
         """
         获取当前缓冲区内容
         
         Returns:
-            缓冲区内的全部内容
+            缓冲区内的全部内容（最多buffer_size个字符）
         """
-        return self.buffer
+        if len(self._chunks) != 1 or self._length > self.buffer_size:
+            self._compact()
+        return self._chunks[0]
+    
+    @property
+    def buffer(self) -> str:
+        """缓冲区内容，与get_buffer()相同"""
+        return self.get_buffer()
+    
+    @buffer.setter
+    def buffer(self, value: str):
+        """直接替换缓冲区内容"""
+        self._chunks = [value]
+        self._length = len(value)
     
     def clear(self):
         """清空缓冲区"""
-        self.buffer = ""
+        self._chunks = []
+        self._length = 0
         self.processed_content = ""
 
 
@@ -67,12 +93,19 @@ class TagTracker:
             output_formats: 输出格式配置，默认从配置文件中获取
         """
         self.output_formats = output_formats or PROMPT_CONFIG["output_format"]
-        self.open_tags: List[str] = []
+        self.open_tags: List[Dict[str, Any]] = []
         self.complete_contents: List[Dict[str, Any]] = []
         
-        # 编译正则表达式来匹配所有可能的开始和结束标签
-        self._start_tag_patterns = {}
-        self._end_tag_patterns = {}
+        # 尚未处理完的文本尾部（按块保存，需要扫描标签时才合并）、其总长度，
+        # 以及下一次扫描的起始位置（相对于合并后的文本）
+        self._chunks: List[str] = []
+        self._length = 0
+        self._scan_pos = 0
+        
+        # 将所有开始和结束标签编译成一个正则，单次扫描即可按顺序得到全部标签事件
+        union_parts = []
+        # (格式类型, 是否为开始标签, 是否带id参数)，与union_parts一一对应
+        union_tags = []
         
         for format_type, format_info in self.output_formats.items():
             # 处理包含参数的标签（如OPTION的id）
@@ -81,75 +114,130 @@ class TagTracker:
                 # 创建正则模式来匹配带参数的标签
                 # 例如: <OPTION id="xxx"> 转换为 <OPTION id="([^"]+)">
                 pattern = re.escape(start_tag).replace('\\{id\\}', '([^"]+)')
-                self._start_tag_patterns[format_type] = re.compile(pattern)
+                union_tags.append((format_type, True, True))
             else:
                 # 对于没有参数的标签，使用精确匹配
-                self._start_tag_patterns[format_type] = re.compile(re.escape(start_tag))
+                pattern = re.escape(start_tag)
+                union_tags.append((format_type, True, False))
+            union_parts.append(pattern)
                 
             # 结束标签总是精确匹配
-            self._end_tag_patterns[format_type] = re.compile(re.escape(format_info["end_tag"]))
+            union_parts.append(re.escape(format_info["end_tag"]))
+            union_tags.append((format_type, False, False))
+        
+        self._tag_pattern, outer_groups = compile_tag_union(union_parts)
+        
+        # 外层分组编号 -> (格式类型, 是否为开始标签, id分组编号)
+        self._tag_groups = {
+            group: (format_type, is_start, group + 1 if has_id else None)
+            for group, (format_type, is_start, has_id) in zip(outer_groups, union_tags)
+        }
+        
+        # 标签的首字符和尾字符（默认配置下即'<'和'>'），用于快速路径和识别被截断的标签
+        all_tags = [
+            format_info[key]
+            for format_info in self.output_formats.values()
+            for key in ("start_tag", "end_tag")
+        ]
+        self._tag_openers = sorted({tag[0] for tag in all_tags})
+        self._find_closer = re.compile(f"[{re.escape(''.join({tag[-1] for tag in all_tags}))}]").search
+        # 所有标签都以'<'开头时feed可使用快速路径
+        self._lt_tags_only = self._tag_openers == ["<"]
     
-    def process_chunk(self, chunk: str) -> List[Dict[str, Any]]:
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
         """
-        处理文本块，跟踪标签状态并返回完整的内容段
+        增量处理新到达的文本块，只扫描此前未扫描过的部分
         
         Args:
-            chunk: 文本块
+            chunk: 新到达的文本块
             
         Returns:
-            完整的内容段列表，每个元素包含类型和内容
+            本次新完成的内容段列表，每个元素包含类型和内容
         """
+        # 快速路径：块中没有'<'且没有待补全的不完整标签时，不可能产生新标签
+        if "<" not in chunk and self._lt_tags_only and self._scan_pos == self._length:
+            if self.open_tags:
+                # 仍在标签内部，只需保留文本作为内容；只追加不合并，避免长标签体被反复复制
+                self._chunks.append(chunk)
+                self._length += len(chunk)
+                self._scan_pos = self._length
+            return []
+        
+        chunks = self._chunks
+        chunks.append(chunk)
+        text = "".join(chunks) if len(chunks) > 1 else chunk
+        scan_pos = self._scan_pos
+        
         result = []
+        open_tags = self.open_tags
+        tag_groups = self._tag_groups
+        last_end = scan_pos
         
-        for format_type, start_pattern in self._start_tag_patterns.items():
-            # 查找开始标签
-            for start_match in start_pattern.finditer(chunk):
-                # 记录开始标签和位置
-                start_pos = start_match.start()
-                tag_params = {}
-                
-                # 如果是带参数的标签，提取参数
-                if "{" in self.output_formats[format_type]["start_tag"]:
-                    tag_params["id"] = start_match.group(1)
-                
-                self.open_tags.append({
+        # 单次扫描新文本，open_tags作为栈按出现顺序处理开始/结束标签
+        for match in self._tag_pattern.finditer(text, scan_pos):
+            format_type, is_start, id_group = tag_groups[match.lastindex]
+            last_end = match.end()
+            
+            if is_start:
+                # 压入开始标签和内容起始位置
+                open_tags.append({
                     "type": format_type,
-                    "start_pos": start_pos,
-                    "params": tag_params
+                    "content_start": last_end,
+                    "params": {"id": match.group(id_group)} if id_group else {}
                 })
+                continue
+            
+            # 从栈顶向下查找同类型的开始标签，标签正确嵌套时就是栈顶
+            for i in range(len(open_tags) - 1, -1, -1):
+                tag_info = open_tags[i]
+                if tag_info["type"] == format_type:
+                    # 创建完整内容对象
+                    complete_content = {
+                        "type": format_type,
+                        "content": text[tag_info["content_start"]:match.start()],
+                        **tag_info["params"]
+                    }
+                    
+                    result.append(complete_content)
+                    self.complete_contents.append(complete_content)
+                    
+                    # 出栈；未闭合的内层标签保留，仍可在之后闭合
+                    del open_tags[i]
+                    break
         
-        # 查找结束标签并匹配开始标签
-        for format_type, end_pattern in self._end_tag_patterns.items():
-            for end_match in end_pattern.finditer(chunk):
-                end_pos = end_match.end()
-                
-                # 查找对应的开始标签
-                for i, tag_info in enumerate(self.open_tags):
-                    if tag_info["type"] == format_type:
-                        # 找到匹配的标签对
-                        full_content = chunk[tag_info["start_pos"]:end_pos]
-                        start_tag = self._start_tag_patterns[format_type].search(full_content).group(0)
-                        end_tag = end_pattern.search(full_content).group(0)
-                        
-                        # 提取标签之间的纯文本内容
-                        content = full_content[len(start_tag):-len(end_tag)]
-                        
-                        # 创建完整内容对象
-                        complete_content = {
-                            "type": format_type,
-                            "content": content,
-                            **tag_info["params"]
-                        }
-                        
-                        result.append(complete_content)
-                        self.complete_contents.append(complete_content)
-                        
-                        # 从开放标签列表中删除已处理的标签
-                        self.open_tags.pop(i)
-                        break
+        # 末尾可能有被分割到下一块的不完整标签，下次从它的首字符开始扫描
+        scan_pos = len(text)
+        partial = max(text.rfind(c, last_end) for c in self._tag_openers)
+        if partial != -1 and self._find_closer(text, partial) is None:
+            scan_pos = partial
+        
+        # 丢弃不再需要的前缀：保留最早未闭合标签的内容及未扫描部分
+        keep_from = scan_pos
+        for tag_info in self.open_tags:
+            keep_from = min(keep_from, tag_info["content_start"])
+        if keep_from:
+            text = text[keep_from:]
+            scan_pos -= keep_from
+            for tag_info in self.open_tags:
+                tag_info["content_start"] -= keep_from
         
+        self._chunks = [text] if text else []
+        self._length = len(text)
+        self._scan_pos = scan_pos
         return result
     
+    def process_chunk(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        处理文本块，跟踪标签状态并返回完整的内容段（等同于feed）
+        
+        Args:
+            chunk: 新到达的文本块
+            
+        Returns:
+            完整的内容段列表，每个元素包含类型和内容
+        """
+        return self.feed(chunk)
+    
     def get_complete_contents(self) -> List[Dict[str, Any]]:
         """
         获取所有已完成的内容段
@@ -163,6 +251,9 @@ class TagTracker:
         """清空跟踪状态"""
         self.open_tags = []
         self.complete_contents = []
+        self._chunks = []
+        self._length = 0
+        self._scan_pos = 0
 
 
 class StreamProcessor:
@@ -198,6 +289,7 @@ class StreamProcessor:
         self.buffer.clear()
         self.tag_tracker.clear()
         self.all_content = []
+        chunk_count = 0
         
         try:
             async for chunk in stream:
@@ -208,8 +300,8 @@ class StreamProcessor:
                 if self.raw_content_callback:
                     self.raw_content_callback(chunk)
                 
-                # 处理标签
-                complete_contents = self.tag_tracker.process_chunk(self.buffer.get_buffer())
+                # 增量处理标签，只扫描新到达的文本
+                complete_contents = self.tag_tracker.feed(chunk)
                 
                 # 处理完整内容段
                 for content in complete_contents:
@@ -219,8 +311,11 @@ class StreamProcessor:
                     if content["type"] in self.callbacks:
                         self.callbacks[content["type"]](content)
                 
-                # 允许事件循环执行其他任务
-                await asyncio.sleep(0)
+                # 流本身在等待网络数据时已会让出事件循环；
+                # 这里只在数据连续到达时每隔若干块主动让出一次，避免回调长时间占用
+                chunk_count += 1
+                if chunk_count % _YIELD_EVERY == 0:
+                    await asyncio.sleep(0)
                 
         except Exception as e:
             # 记录错误但允许继续处理已收到的内容
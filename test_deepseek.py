@@ -4,8 +4,8 @@
 
 import asyncio
 import os
-from ai_core import AICore, create_messages
-from config import PROMPT_CONFIG
+from ai_core import AICore, create_messages, shutdown_clients, install_event_loop_policy
+from config import SYSTEM_PROMPT_CANONICAL
 
 async def test_deepseek_api():
     """测试DeepSeek API调用"""
@@ -14,7 +14,7 @@ async def test_deepseek_api():
     # 创建AI核心实例，使用DeepSeek提供商
     async with AICore(provider="deepseek") as ai:
         # 准备提示词
-        system_prompt = PROMPT_CONFIG["system_prompt"]
+        system_prompt = SYSTEM_PROMPT_CANONICAL
         user_prompt = "我是一位冒险家，刚刚进入一个神秘的洞穴。描述我看到了什么，并给我三个可能的行动选择。"
         
         # 创建消息列表
@@ -29,8 +29,11 @@ async def test_deepseek_api():
         except Exception as e:
             print(f"\n错误: {str(e)}")
             raise
+        finally:
+            await shutdown_clients()
             
     print("\nDeepSeek API测试完成！")
 
 if __name__ == "__main__":
+    install_event_loop_policy()
     asyncio.run(test_deepseek_api()) 
\ No newline at end of file